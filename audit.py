@@ -0,0 +1,105 @@
+import asyncio
+import discord
+from metrics import Gauge, registry, collectors
+from config_registry import config
+
+# Discord rejects a message whose embeds add up to more than this many characters
+MAX_MESSAGE_EMBED_SIZE = 6000
+MAX_FIELD_VALUE = 1024
+
+# Queues command audit entries and posts them in the background, packing up
+# to 10 embeds into one message. When the queue is full new entries are
+# dropped and counted rather than slowing down the command being logged.
+class AuditLogger:
+    def __init__(self, max_queue=1000, batch_size=10, flush_interval=2.0):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue = None
+        self._worker = None
+
+    def log(self, channel, embed):
+        if self._queue is None:
+            self._queue = asyncio.Queue(self.max_queue)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        try:
+            self._queue.put_nowait((channel, embed))
+            self.queued += 1
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def _next_batch(self):
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            by_channel = {}
+            for channel, embed in batch:
+                by_channel.setdefault(channel, []).append(embed)
+            for channel, embeds in by_channel.items():
+                for message_embeds in self._split(embeds):
+                    try:
+                        await channel.send(embeds=message_embeds)
+                        self.sent += len(message_embeds)
+                    except Exception as e:
+                        self.failed += len(message_embeds)
+                        print(f"Failed to send audit log: {e}")
+
+    # Group embeds into messages that stay within Discord's size limits
+    def _split(self, embeds):
+        messages, current, size = [], [], 0
+        for embed in embeds:
+            if current and size + len(embed) > MAX_MESSAGE_EMBED_SIZE:
+                messages.append(current)
+                current, size = [], 0
+            current.append(embed)
+            size += len(embed)
+        if current:
+            messages.append(current)
+        return messages
+
+    def pending(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+audit_logger = AuditLogger(config.get("audit_queue_size", 1000))
+
+audit_entries = Gauge("audit_log_entries", "Command audit log entries by outcome", ("state",))
+registry.append(audit_entries)
+
+def collect_audit_metrics():
+    for state in ("queued", "sent", "dropped", "failed"):
+        audit_entries.set(state, value=getattr(audit_logger, state))
+    audit_entries.set("pending", value=audit_logger.pending())
+
+collectors.append(collect_audit_metrics)
+
+def truncate(value, limit=MAX_FIELD_VALUE):
+    return value if len(value) <= limit else value[:limit - 3] + "..."
+
+async def log_command(interaction, command_name, args):
+    log_channel = interaction.guild.get_channel(config["log_channel_id"]) if interaction.guild else None
+    if log_channel:
+        embed = discord.Embed(title="Command Used", color=discord.Color.blue())
+        embed.add_field(name="User", value=interaction.user.mention, inline=True)
+        embed.add_field(name="Command", value=command_name, inline=True)
+        embed.add_field(name="Arguments", value=truncate(str(args)), inline=True)
+        embed.add_field(name="Channel", value=interaction.channel.mention, inline=True)
+        embed.add_field(name="Timestamp", value=interaction.created_at.strftime("%Y-%m-%d %H:%M:%S"), inline=True)
+        audit_logger.log(log_channel, embed)
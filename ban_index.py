@@ -0,0 +1,70 @@
+import heapq
+from datetime import datetime
+
+def parse_date(date_str):
+    if not date_str:
+        return None
+    try:
+        return datetime.strptime(date_str, '%Y-%m-%d').date()
+    except ValueError:
+        try:
+            return datetime.strptime(date_str, '%d-%m-%Y').date()
+        except ValueError:
+            try:
+                return datetime.strptime(date_str, '%Y/%m/%d').date()
+            except ValueError:
+                return None
+
+# Min-heap of bans keyed on their parsed expiry date. Replaced or removed bans
+# leave stale heap entries behind which are skipped when they reach the top.
+class BanExpiryIndex:
+    def __init__(self):
+        self._heap = []
+        self._expiries = {}  # username -> (expiry date, raw banneduntil)
+
+    def __len__(self):
+        return len(self._expiries)
+
+    def set(self, username, banned_until):
+        current = self._expiries.get(username)
+        if current and current[1] == banned_until:
+            return
+        expires = parse_date(banned_until)
+        self._expiries[username] = (expires, banned_until)
+        if expires is not None:
+            heapq.heappush(self._heap, (expires, username))
+            self._compact()
+
+    def remove(self, username):
+        self._expiries.pop(username, None)
+
+    def sync(self, banned_users):
+        for username in [user for user in self._expiries if user not in banned_users]:
+            self.remove(username)
+        for username, details in banned_users.items():
+            self.set(username, details.get('banneduntil'))
+
+    def _is_current(self, entry):
+        expires, username = entry
+        current = self._expiries.get(username)
+        return current is not None and current[0] == expires
+
+    def _compact(self):
+        if len(self._heap) > 2 * len(self._expiries) + 64:
+            self._heap = [entry for entry in self._heap if self._is_current(entry)]
+            heapq.heapify(self._heap)
+
+    def next_expiry(self):
+        while self._heap and not self._is_current(self._heap[0]):
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_expired(self, current_date):
+        expired = []
+        while True:
+            expires = self.next_expiry()
+            if expires is None or expires > current_date:
+                return expired
+            expires, username = heapq.heappop(self._heap)
+            del self._expiries[username]
+            expired.append(username)
@@ -0,0 +1,118 @@
+import csv
+import io
+import json
+
+# Parsers for ban requests. Each returns (entries, errors) where entries is a
+# list of (name, date, reason) and errors describes every rejected entry.
+
+# A date parse_date cannot read (e.g. "Permanent") is kept as is and the ban never expires
+def _validate(entries, errors, name, ban_date, reason, where):
+    name, ban_date, reason = name.strip(), ban_date.strip(), reason.strip()
+    if not name:
+        errors.append(f"{where}: missing name")
+    elif not ban_date:
+        errors.append(f"{where}: missing date for {name}")
+    else:
+        entries.append((name, ban_date, reason))
+
+# Name\nDate\nReason blocks, separated by blank lines or simply one after another
+def parse_ban_message(content):
+    entries, errors = [], []
+    blocks = [block for block in content.strip().replace('\r\n', '\n').split('\n\n') if block.strip()]
+    for number, block in enumerate(blocks, start=1):
+        lines = [line for line in block.split('\n') if line.strip()]
+        if len(lines) % 3:
+            errors.append(f"Entry {number}: expected Name, Date and Reason lines, got {len(lines)} lines")
+            continue
+        for i in range(0, len(lines), 3):
+            _validate(entries, errors, lines[i], lines[i + 1], lines[i + 2], f"Entry {number}")
+    return entries, errors
+
+# name,date,reason rows with an optional header row
+def parse_ban_csv(text):
+    entries, errors = [], []
+    for number, row in enumerate(csv.reader(io.StringIO(text)), start=1):
+        if not row or not any(cell.strip() for cell in row):
+            continue
+        if number == 1 and row[0].strip().lower() in ('name', 'username'):
+            continue
+        if len(row) < 3:
+            errors.append(f"Row {number}: expected name,date,reason")
+            continue
+        _validate(entries, errors, row[0], row[1], ','.join(row[2:]), f"Row {number}")
+    return entries, errors
+
+# Either a list of {"name", "date", "reason"} objects or a ban.json style dict
+def parse_ban_json(text):
+    entries, errors = [], []
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        return entries, [f"Invalid JSON: {e}"]
+
+    if isinstance(data, dict):
+        for name, details in data.items():
+            if not isinstance(details, dict):
+                errors.append(f"{name}: expected an object")
+                continue
+            _validate(entries, errors, name, str(details.get('banneduntil', '')), str(details.get('BanReason', '')), name)
+    elif isinstance(data, list):
+        for number, item in enumerate(data, start=1):
+            if not isinstance(item, dict):
+                errors.append(f"Item {number}: expected an object")
+                continue
+            name = item.get('name', item.get('username', ''))
+            _validate(entries, errors, str(name), str(item.get('date', item.get('banneduntil', ''))), str(item.get('reason', item.get('BanReason', ''))), f"Item {number}")
+    else:
+        errors.append("Expected a list or an object")
+    return entries, errors
+
+def is_ban_file(filename):
+    return filename.lower().endswith(('.csv', '.json'))
+
+def parse_ban_file(filename, data):
+    text = data.decode('utf-8-sig', 'replace')
+    if filename.lower().endswith('.json'):
+        return parse_ban_json(text)
+    if filename.lower().endswith('.csv'):
+        return parse_ban_csv(text)
+    return [], [f"{filename}: only .csv and .json files are supported"]
+
+# /massban takes a single line: entries separated by ';', fields by ','
+def parse_ban_list(text):
+    return parse_ban_csv('\n'.join(entry for entry in text.split(';')))
+
+# Keep the last entry for a name that appears more than once
+def dedupe_bans(entries):
+    return list({name: (name, ban_date, reason) for name, ban_date, reason in entries}.values())
+
+# results maps username -> {server_name: ServerResult}
+def format_ban_report(results):
+    lines = [f"Banned {len(results)} users:"]
+    for username, server_results in results.items():
+        succeeded = sum(1 for result in server_results.values() if result.ok)
+        line = f"{username}: {succeeded}/{len(server_results)} servers"
+        failed = [f"{name} ({result.error})" for name, result in server_results.items() if not result.ok]
+        if failed:
+            line += f", failed on {', '.join(failed)}"
+        lines.append(line)
+    return "\n".join(lines)
+
+# Discord messages are capped at 2000 characters
+def split_message(text, limit=1900):
+    chunks, current = [], ""
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        if current and len(current) + len(line) + 1 > limit:
+            chunks.append(current)
+            current = line
+        else:
+            current = f"{current}\n{line}" if current else line
+    if current:
+        chunks.append(current)
+    return chunks
@@ -0,0 +1,116 @@
+import json
+import sqlite3
+import time
+from name_index import NameIndex
+
+# Local source of truth for bans. Each ban is one row keyed by username, so
+# lookups are point queries and changes only touch the rows involved. The
+# revision counter lets the GitHub mirror tell whether it is behind.
+class BanStore:
+    def __init__(self, path='bans.db'):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS bans (username TEXT PRIMARY KEY, details TEXT NOT NULL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        # Bans the bot lifted, so the reconciler knows which names it may unban on servers
+        self.conn.execute('CREATE TABLE IF NOT EXISTS removed (username TEXT PRIMARY KEY, removed_at REAL NOT NULL)')
+        self.conn.commit()
+        self.names = NameIndex(self.usernames())
+        self._listeners = []
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM bans').fetchone()[0]
+
+    def __contains__(self, username):
+        return self.get(username) is not None
+
+    def get(self, username):
+        row = self.conn.execute('SELECT details FROM bans WHERE username = ?', (username,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # Case-insensitive lookup, returns (username as stored, details) or None
+    def find(self, username):
+        details = self.get(username)
+        if details is not None:
+            return username, details
+        for stored_name in self.names.lookup(username):
+            details = self.get(stored_name)
+            if details is not None:
+                return stored_name, details
+        return None
+
+    def items(self):
+        for username, details in self.conn.execute('SELECT username, details FROM bans'):
+            yield username, json.loads(details)
+
+    def usernames(self):
+        return {row[0] for row in self.conn.execute('SELECT username FROM bans')}
+
+    def all(self):
+        return dict(self.items())
+
+    def _meta(self, key):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else 0
+
+    @property
+    def revision(self):
+        return self._meta('revision')
+
+    @property
+    def mirrored_revision(self):
+        return self._meta('mirrored_revision')
+
+    def set_mirrored_revision(self, revision):
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', ('mirrored_revision', revision))
+
+    # Set once GitHub's ban list has been merged in. Until then the store only
+    # holds bans made since the bot started and says nothing about the rest.
+    @property
+    def seeded(self):
+        return bool(self._meta('seeded'))
+
+    def mark_seeded(self):
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', ('seeded', 1))
+
+    def removed_usernames(self):
+        return {row[0] for row in self.conn.execute('SELECT username FROM removed')}
+
+    def prune_removed(self, before):
+        with self.conn:
+            self.conn.execute('DELETE FROM removed WHERE removed_at < ?', (before,))
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    # changes maps username -> ban details, or None to remove the ban.
+    # All changes are written in one transaction.
+    def apply(self, changes):
+        if not changes:
+            return self.revision
+        now = time.time()
+        with self.conn:
+            for username, details in changes.items():
+                if details is None:
+                    if self.conn.execute('DELETE FROM bans WHERE username = ?', (username,)).rowcount:
+                        self.conn.execute('INSERT OR REPLACE INTO removed (username, removed_at) VALUES (?, ?)', (username, now))
+                else:
+                    self.conn.execute('INSERT OR REPLACE INTO bans (username, details) VALUES (?, ?)', (username, json.dumps(details)))
+                    self.conn.execute('DELETE FROM removed WHERE username = ?', (username,))
+            revision = self.revision + 1
+            self.conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', ('revision', revision))
+        for username, details in changes.items():
+            if details is None:
+                self.names.remove(username)
+            else:
+                self.names.add(username)
+        for callback in self._listeners:
+            callback(self, changes.keys())
+        return revision
+
+    def close(self):
+        self.conn.close()
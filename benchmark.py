@@ -0,0 +1,356 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from base64 import b64decode, b64encode
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+from aiohttp import web
+
+# Local benchmark for the bot. Starts fake Pavlov RCON servers and a fake
+# GitHub contents API on localhost, loads bot.py against them from a scratch
+# directory and times the ban, unban, stats and lookup paths.
+#
+#   python benchmark.py --servers 20 --bans 5000 --latency-ms 5
+
+class FakePavlovServer:
+    def __init__(self, password, players=10, latency=0.0, failure_rate=0.0):
+        self.password = password
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.bans = set()
+        self.commands = 0
+        self.players = [
+            {"Username": f"player{i}", "UniqueId": str(76561190000000000 + i), "Kills": 0, "Deaths": 0}
+            for i in range(players)
+        ]
+        self.port = None
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            writer.write(b"Password: ")
+            await writer.drain()
+            password = (await reader.read(1024)).decode().strip()
+            if password != hashlib.md5(self.password.encode()).hexdigest():
+                writer.write(b"Authenticated=0")
+                return
+            writer.write(b"Authenticated=1")
+            await writer.drain()
+
+            while True:
+                data = await reader.read(1024)
+                if not data:
+                    return
+                if random.random() < self.failure_rate:
+                    return
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                self.commands += 1
+                writer.write(json.dumps(self._execute(data.decode().strip())).encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def _execute(self, command):
+        name, _, argument = command.partition(' ')
+        if name == "RefreshList":
+            for player in self.players:
+                player["Kills"] += random.randint(0, 3)
+                player["Deaths"] += random.randint(0, 2)
+            return {"Command": "RefreshList", "PlayerList": self.players}
+        if name == "ban":
+            self.bans.add(argument)
+            return {"Command": "Ban", "Success": True}
+        if name == "unban":
+            self.bans.discard(argument)
+            return {"Command": "Unban", "Success": True}
+        if name == "banlist":
+            return {"Command": "Banlist", "BanList": sorted(self.bans)}
+        return {"Command": name, "Successful": True}
+
+class FakeGitHub:
+    def __init__(self, path, latency=0.0):
+        self.path = path
+        self.latency = latency
+        self.content = None
+        self.sha = None
+        self.gets = 0
+        self.not_modified = 0
+        self.puts = 0
+        self.conflicts = 0
+        self.fail_puts = 0  # answer this many PUTs with a 409, as if someone else committed first
+        self.port = None
+        self._runner = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get(self.path, self._get)
+        app.router.add_put(self.path, self._put)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    def _store(self, content):
+        self.content = content
+        self.sha = hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    async def _get(self, request):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.gets += 1
+        if self.content is None:
+            return web.json_response({"message": "Not Found"}, status=404)
+        etag = f'"{self.sha}"'
+        if request.headers.get('If-None-Match') == etag:
+            self.not_modified += 1
+            return web.Response(status=304, headers={'ETag': etag})
+        body = {"sha": self.sha, "content": b64encode(self.content.encode('utf-8')).decode('utf-8')}
+        return web.json_response(body, headers={'ETag': etag})
+
+    async def _put(self, request):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.puts += 1
+        data = await request.json()
+        if self.fail_puts:
+            self.fail_puts -= 1
+            self.conflicts += 1
+            return web.json_response({"message": "sha does not match"}, status=409)
+        if self.content is not None and data.get('sha') != self.sha:
+            self.conflicts += 1
+            return web.json_response({"message": "sha does not match"}, status=409)
+        self._store(b64decode(data['content']).decode('utf-8'))
+        return web.json_response({"content": {"sha": self.sha}})
+
+class FakeInteraction:
+    def __init__(self):
+        self.guild = None
+        self.user = SimpleNamespace(roles=[], mention="@benchmark")
+        self.channel = SimpleNamespace(mention="#benchmark")
+        self.created_at = datetime.now()
+        self.messages = []
+        self.response = SimpleNamespace(send_message=self._send, defer=self._defer)
+        self.followup = SimpleNamespace(send=self._send)
+
+    async def _send(self, content=None, **kwargs):
+        self.messages.append(content if content is not None else kwargs.get('embed'))
+
+    async def _defer(self, **kwargs):
+        pass
+
+    async def edit_original_response(self, content=None, **kwargs):
+        self.messages.append(content)
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def report(name, samples, elapsed, operations=None):
+    operations = operations or len(samples)
+    print(f"{name:<34} {len(samples):>7} {operations / elapsed:>12.1f} {percentile(samples, 50) * 1000:>10.3f} {percentile(samples, 99) * 1000:>10.3f}")
+
+async def measure(name, make_call, iterations, operations_per_call=1):
+    samples = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        call_started = time.perf_counter()
+        await make_call(i)
+        samples.append(time.perf_counter() - call_started)
+    report(name, samples, time.perf_counter() - started, iterations * operations_per_call)
+
+def write_config(workdir, github, fake_servers, args):
+    config = {
+        "discord_bot_token": "benchmark",
+        "allowed_channel_id": 0,
+        "github_username": "benchmark",
+        "repo_name": "bans",
+        "file_path": "ban.json",
+        "access_token": "benchmark",
+        "required_roles": [],
+        "log_channel_id": 0,
+        "github_api_url": f"http://127.0.0.1:{github.port}",
+        "github_write_window": 0,
+        "ban_store_path": os.path.join(workdir, "bans.db"),
+        "stats_path": os.path.join(workdir, "player_stats"),
+        "player_list_ttl": 0,
+        "rcon_timeout": args.timeout,
+        "rcon_concurrency": args.concurrency,
+    }
+    servers = {
+        f"Bench{i}": {"ip": "127.0.0.1", "port": server.port, "password": "benchmark"}
+        for i, server in enumerate(fake_servers)
+    }
+    with open(os.path.join(workdir, 'config.json'), 'w') as f:
+        json.dump(config, f)
+    with open(os.path.join(workdir, 'servers.json'), 'w') as f:
+        json.dump(servers, f)
+
+async def run(args):
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    workdir = tempfile.mkdtemp(prefix='pavlov-bench-')
+
+    fake_servers = [
+        FakePavlovServer("benchmark", args.players, args.latency_ms / 1000, args.failure_rate)
+        for _ in range(args.servers)
+    ]
+    for server in fake_servers:
+        await server.start()
+    github = FakeGitHub("/repos/benchmark/bans/contents/ban.json", args.github_latency_ms / 1000)
+    await github.start()
+
+    write_config(workdir, github, fake_servers, args)
+    os.chdir(workdir)
+    sys.path.insert(0, repo_dir)
+    import bot as bot_module
+    import leaderboardcmd
+    from rcon import rcon_pool
+    await bot_module.setup(bot_module.bot)
+
+    print(f"{args.servers} servers, {args.bans} bans, {args.players} players per server, "
+          f"{args.latency_ms}ms RCON latency, {args.failure_rate:.0%} RCON failures, {args.github_latency_ms}ms GitHub latency")
+    print(f"{'scenario':<34} {'calls':>7} {'ops/s':>12} {'p50 ms':>10} {'p99 ms':>10}")
+
+    await measure("ban_user_on_all_servers", lambda i: bot_module.ban_user_on_all_servers(f"single{i}"),
+                  args.iterations, args.servers)
+
+    batch = [(f"bulk{i}", "2099-01-01", "benchmark") for i in range(min(args.bans, 500))]
+    await measure(f"process_bans ({len(batch)} bans)", lambda i: bot_module.process_bans(batch), 1, len(batch) * args.servers)
+
+    today = date.today()
+    expired = max(1, args.bans // 100)
+    bans = {}
+    for i in range(args.bans):
+        until = today - timedelta(days=1) if i < expired else today + timedelta(days=1 + i % 365)
+        bans[f"user{i}"] = {"banneduntil": until.strftime('%Y-%m-%d'), "BanReason": "benchmark"}
+    bot_module.ban_store.apply(bans)
+    bot_module.ban_index.sync(bot_module.ban_store)
+
+    await measure(f"check_bans ({expired} expired)", lambda i: bot_module.check_bans(), 1, expired)
+    await measure("check_bans (nothing expired)", lambda i: bot_module.check_bans(), args.iterations)
+    await measure("github mirror export (full)", lambda i: bot_module.github_mirror.export(), 1)
+    await measure("github mirror export (no change)", lambda i: bot_module.github_mirror.export(), args.iterations)
+
+    # One round of the stats poller over every server, as update_player_stats runs it
+    async def poll_all_servers():
+        await asyncio.gather(*(leaderboardcmd.stats_poller.poll(server_name) for server_name in leaderboardcmd.servers))
+        await leaderboardcmd.save_player_stats()
+
+    await measure("update_player_stats (one poll)", lambda i: poll_all_servers(),
+                  max(1, args.iterations // 10), args.servers)
+
+    checkunban = bot_module.bot.tree.get_command("checkunban").callback
+    await measure("/checkunban", lambda i: checkunban(FakeInteraction(), f"user{random.randrange(args.bans)}"),
+                  args.iterations)
+
+    leaderboard = bot_module.bot.tree.get_command("leaderboard").callback
+    await measure("/leaderboard Kills", lambda i: leaderboard(FakeInteraction(), "Kills"), args.iterations)
+    await measure("/leaderboard KD", lambda i: leaderboard(FakeInteraction(), "KD"), args.iterations)
+
+    print(f"GitHub: {github.gets} GETs ({github.not_modified} not modified), {github.puts} PUTs ({github.conflicts} conflicts)")
+    print(f"RCON: {sum(server.commands for server in fake_servers)} commands answered")
+
+    await rcon_pool.close()
+    await bot_module.ledger_client.close()
+    bot_module.ban_store.close()
+    await github.stop()
+    for server in fake_servers:
+        await server.stop()
+
+# Offline checks of the GitHub mirror against the fake contents API
+async def check_mirror():
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, repo_dir)
+    from ban_store import BanStore
+    from github_ledger import GitHubLedgerClient, BanLedger, GitHubMirror
+
+    github = FakeGitHub("/repos/benchmark/bans/contents/ban.json")
+    await github.start()
+    github._store(json.dumps({"imported": {"banneduntil": "2099-01-01", "BanReason": "on GitHub"}}))
+    client = GitHubLedgerClient(f"http://127.0.0.1:{github.port}{github.path}", "benchmark", retries=0)
+    store = BanStore(os.path.join(tempfile.mkdtemp(prefix='pavlov-mirror-'), 'bans.db'))
+    mirror = GitHubMirror(store, BanLedger(client), window=0, retries=2)
+
+    results = []
+    try:
+        await mirror.seed_store()
+        results.append(("seed_store imports ban.json into an empty store",
+                        store.all() == {"imported": {"banneduntil": "2099-01-01", "BanReason": "on GitHub"}}
+                        and store.mirrored_revision == store.revision))
+
+        puts = github.puts
+        results.append(("export with nothing changed does not write", await mirror.export() and github.puts == puts))
+
+        store.apply({"new": {"banneduntil": "2099-01-01", "BanReason": "check"}})
+        mirror.notify("User new banned")
+        results.append(("export writes the whole store", await mirror.export() and json.loads(github.content) == store.all()))
+
+        store.apply({"other": {"banneduntil": "2099-01-01", "BanReason": "check"}})
+        github.fail_puts = 1
+        results.append(("a conflicting commit is retried on top of it",
+                        await mirror.export() and github.conflicts == 1 and json.loads(github.content) == store.all()))
+
+        store.apply({"new": None})
+        github.fail_puts = 3
+        results.append(("a failed export keeps the store marked as behind",
+                        not await mirror.export() and store.mirrored_revision != store.revision))
+
+        # GitHub was unreachable at startup and a moderator banned someone
+        github._store(json.dumps({f"user{i}": {"banneduntil": "2099-01-01", "BanReason": "on GitHub"} for i in range(100)}))
+        late_store = BanStore(os.path.join(tempfile.mkdtemp(prefix='pavlov-mirror-'), 'bans.db'))
+        late_store.apply({"local": {"banneduntil": "2099-01-01", "BanReason": "check"}})
+        late_mirror = GitHubMirror(late_store, BanLedger(client), window=0, retries=2)
+        exported = await late_mirror.export()
+        results.append(("bans made before the first import are merged into ban.json",
+                        exported and late_store.seeded and len(late_store) == 101 and json.loads(github.content) == late_store.all()))
+        late_store.close()
+    finally:
+        await client.close()
+        store.close()
+        await github.stop()
+
+    for name, passed in results:
+        print(f"{'ok' if passed else 'FAILED':<6} {name}")
+    return all(passed for _, passed in results)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bot against fake Pavlov and GitHub services")
+    parser.add_argument("--servers", type=int, default=10)
+    parser.add_argument("--bans", type=int, default=1000)
+    parser.add_argument("--players", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=2.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--github-latency-ms", type=float, default=10.0)
+    parser.add_argument("--timeout", type=float, default=5.0)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--check-mirror", action="store_true", help="only run the offline GitHub mirror checks")
+    args = parser.parse_args()
+    random.seed(args.seed)
+    if args.check_mirror:
+        sys.exit(0 if asyncio.run(check_mirror()) else 1)
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
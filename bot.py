@@ -1,16 +1,20 @@
 import discord
-from discord.ext import commands, tasks
-import requests
-import json
-from base64 import b64decode, b64encode
-from datetime import datetime, date
+from discord.ext import commands
+from datetime import datetime, date, time
 import asyncio
-from commands import setup_commands, get_server_details, send_pavlov_command  # Import necessary functions from commands.py
-from leaderboardcmd import setup_leaderboard_commands, update_player_stats  # Import leaderboard functions
-
-# Load configuration
-with open('config.json') as config_file:
-    config = json.load(config_file)
+from commands import setup_commands  # Import necessary functions from commands.py
+import rcon
+from rcon import format_server_results
+from ban_intake import parse_ban_message, parse_ban_file, is_ban_file, dedupe_bans, format_ban_report, split_message
+from github_ledger import GitHubLedgerClient, GitHubError, BanLedger, GitHubMirror
+from ban_store import BanStore
+from metrics import command_latency, loop_duration, start_metrics_server
+from reconcile import BanReconciler
+from ban_index import BanExpiryIndex, parse_date
+from leaderboardcmd import setup_leaderboard_commands, update_player_stats, save_player_stats, handle_player_deltas, counter_tracker  # Import leaderboard functions
+from fleet import FleetWorkers
+from player_lists import player_list_cache
+from config_registry import config, registry, servers
 
 # Discord bot setup
 intents = discord.Intents.default()
@@ -20,109 +24,147 @@ intents.message_content = True
 bot = commands.Bot(command_prefix='!', intents=intents)
 
 # Constants
-allowed_channel_id = config["allowed_channel_id"]
 github_username = config["github_username"]
 repo_name = config["repo_name"]
 file_path = config["file_path"]
 access_token = config["access_token"]
-api_url = f'https://api.github.com/repos/{github_username}/{repo_name}/contents/{file_path}'  # DO NOT TOUCH
+github_api = config.get("github_api_url", "https://api.github.com")
+api_url = f'{github_api}/repos/{github_username}/{repo_name}/contents/{file_path}'  # DO NOT TOUCH
 bot_status = config.get("bot_status", "Online")
 bot_version = config.get("bot_version", "1.0.0")
-log_channel_id = config["log_channel_id"]
-
-# Load server details from JSON file
-with open('servers.json') as f:
-    servers = json.load(f)
 
-# Functions
-async def update_github_file(api_url, content, commit_message):
-    response = requests.get(api_url)
-    data = json.loads(response.content.decode('utf-8'))
+ledger_client = GitHubLedgerClient(api_url, access_token, config.get("github_timeout", 10))
+ban_ledger = BanLedger(ledger_client)
+ban_store = BanStore(config.get("ban_store_path", "bans.db"))
+github_mirror = GitHubMirror(ban_store, ban_ledger, config.get("github_write_window", 2))
+ban_index = BanExpiryIndex()
 
-    url = data.get('url', '')
-    sha = data.get('sha', '')
+# With fleet_workers set, worker processes own the RCON connections used for
+# player polling, /players refreshes, ban propagation and reconciliation
+fleet = None
+if config.get("fleet_workers", 0):
+    fleet = FleetWorkers(servers, config["fleet_workers"], config.get("rcon_timeout", 10))
+    player_list_cache.send = fleet.send
+ban_transport = fleet or rcon  # provides send_to_all_servers and send_commands_to_all_servers
+ban_reconciler = BanReconciler(ban_store, send=fleet.send if fleet else None)
 
-    update_url = f'{url}?access_token={access_token}'
+def on_servers_changed(added, removed, changed):
+    for server_name in removed | changed:
+        ban_reconciler.forget(server_name)
+    if fleet:
+        fleet.reshard()
 
-    data = {
-        'message': commit_message,
-        'content': b64encode(json.dumps(content, indent=4).encode('utf-8')).decode('utf-8'),
-        'sha': sha,
-    }
+registry.add_listener(on_servers_changed)
 
-    response = requests.put(update_url, headers={'Authorization': f'token {access_token}'}, json=data)
-    print(response.text)
+ban_index_changed = None
 
+# Functions
 async def log_to_console(message):
     print(message)
 
-async def log_command(interaction, command_name, args):
-    log_channel = interaction.guild.get_channel(log_channel_id)
-    if log_channel:
-        embed = discord.Embed(title="Command Used", color=discord.Color.blue())
-        embed.add_field(name="User", value=interaction.user.mention, inline=True)
-        embed.add_field(name="Command", value=command_name, inline=True)
-        embed.add_field(name="Arguments", value=str(args), inline=True)
-        embed.add_field(name="Channel", value=interaction.channel.mention, inline=True)
-        embed.add_field(name="Timestamp", value=interaction.created_at.strftime("%Y-%m-%d %H:%M:%S"), inline=True)
-        await log_channel.send(embed=embed)
-
-# Check bans every minute
-@tasks.loop(minutes=1)
-async def check_bans():
-    response = requests.get(api_url)
-
-    if response.status_code == 200:
-        data = json.loads(response.content.decode('utf-8'))
+# Read on every use so config.json edits apply without a restart
+def rcon_limits():
+    return config.get("rcon_concurrency", 8), config.get("rcon_timeout", 10)
 
-        if 'content' in data:
-            raw_content = b64decode(data['content']).decode('utf-8')
-            try:
-                banned_users = json.loads(raw_content)
-            except json.JSONDecodeError as e:
-                return
-        else:
-            return
+# Keep the expiry index in step with the ledger and wake the unban scheduler
+def on_ledger_change(banned_users, changed):
+    if changed is None:
+        ban_index.sync(banned_users)
     else:
-        return
+        for user in changed:
+            details = banned_users.get(user)
+            if details:
+                ban_index.set(user, details.get('banneduntil'))
+            else:
+                ban_index.remove(user)
+    wake_unban_scheduler()
 
-    current_date = date.today()
+ban_store.add_listener(on_ledger_change)
 
-    if not banned_users:
+def wake_unban_scheduler():
+    if ban_index_changed is not None:
+        ban_index_changed.set()
+
+async def check_bans():
+    current_date = date.today()
+    users_to_unban = ban_index.pop_expired(current_date)
+    if not users_to_unban:
         return
 
-    users_to_unban = []
-    for user, details in banned_users.items():
-        banned_until = parse_date(details.get('banneduntil'))
-        if banned_until and current_date >= banned_until:
-            # Unban the player via PavlovRCON for all servers
-            for server_name in servers:
-                server_details = get_server_details(server_name, servers)
-                if server_details:
-                    unban_command = f"unban {user}"
-                    await send_pavlov_command(server_details['ip'], server_details['port'], server_details['password'], unban_command)
-            users_to_unban.append(user)
-
-    if users_to_unban:
-        # Remove users from the JSON data
-        for user in users_to_unban:
-            del banned_users[user]
-
-        # Update ban.json on GitHub
-        commit_message = f"Users unbanned as their ban time expired: {', '.join(users_to_unban)}"
-        await update_github_file(api_url, banned_users, commit_message)
-
-def parse_date(date_str):
-    try:
-        return datetime.strptime(date_str, '%Y-%m-%d').date()
-    except ValueError:
+    # Unban the players via PavlovRCON on all servers at once
+    unban_failed = set()
+    for user in users_to_unban:
+        results = await ban_transport.send_to_all_servers(f"unban {user}", servers, *rcon_limits())
+        await log_to_console(f"Unban {user}:\n{format_server_results(results)}")
+        if results and not any(result.ok for result in results.values()):
+            unban_failed.add(user)
+
+    # Remove users from the ban store, ban.json on GitHub follows in the background.
+    # A user banned again while the unbans were being sent keeps the new ban.
+    # Their ban is sent again in case the unban reached a server after it.
+    # A ban whose unban reached no server stays and is retried by the
+    # scheduler; servers that missed an unban get it from the reconciler.
+    expired, rebanned = [], []
+    for user in users_to_unban:
+        details = ban_store.get(user)
+        if details is None:
+            continue
+        expires = parse_date(details.get('banneduntil'))
+        if expires is None or expires > current_date:
+            rebanned.append(user)
+        elif user in unban_failed:
+            ban_index.set(user, details.get('banneduntil'))
+        else:
+            expired.append(user)
+    if rebanned:
+        await ban_users_on_all_servers(rebanned)
+    if expired:
+        ban_store.apply({user: None for user in expired})
+        github_mirror.notify(f"Users unbanned as their ban time expired: {', '.join(expired)}")
+
+# Sleep until the next ban actually expires instead of scanning the ledger
+async def unban_scheduler():
+    global ban_index_changed
+    ban_index_changed = asyncio.Event()
+    while True:
         try:
-            return datetime.strptime(date_str, '%d-%m-%Y').date()
-        except ValueError:
+            with loop_duration.time("unban"):
+                await check_bans()
+        except Exception as e:
+            print(f"Failed to check bans: {e}")
+
+        next_expiry = ban_index.next_expiry()
+        if next_expiry is None:
+            delay = 3600
+        elif next_expiry <= date.today():
+            delay = 60  # the last removal failed, retry shortly
+        else:
+            delay = (datetime.combine(next_expiry, time.min) - datetime.now()).total_seconds()
+            delay = min(max(delay, 1), 3600)
+
+        ban_index_changed.clear()
+        try:
+            await asyncio.wait_for(ban_index_changed.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+# Make sure every server has every ban, e.g. after being down during a ban.
+# reconcile_interval 0 pauses it.
+async def reconcile_bans():
+    while True:
+        interval = config.get("reconcile_interval", 600)
+        if interval:
+            ban_reconciler.concurrency, ban_reconciler.timeout = rcon_limits()
+            ban_reconciler.unban_unlisted = config.get("reconcile_unban_unlisted", False)
+            ban_reconciler.unlisted_ratio = config.get("reconcile_unlisted_ratio", 0.5)
             try:
-                return datetime.strptime(date_str, '%Y/%m/%d').date()
-            except ValueError:
-                return None
+                if not ban_store.seeded:
+                    await github_mirror.seed_store()  # the import failed at startup, try again
+                with loop_duration.time("reconcile"):
+                    await ban_reconciler.run_once()
+            except Exception as e:
+                print(f"Failed to reconcile bans: {e}")
+        await asyncio.sleep(interval or 60)
 
 # Events
 @bot.event
@@ -131,8 +173,21 @@ async def on_ready():
     await log_to_console('Ban Manager Watching')
     await log_to_console('Bot is Online')
 
-    check_bans.start()  # Start the check_bans task when the bot is ready
-    asyncio.create_task(update_player_stats())  # Start tracking player stats
+    if ban_index_changed is None:
+        try:
+            await github_mirror.seed_store()
+        except GitHubError as e:
+            print(f"Could not import bans from GitHub: {e}")
+        ban_index.sync(ban_store)
+        asyncio.create_task(github_mirror.run())  # Mirror the ban store to GitHub
+        if config.get("metrics_port"):
+            await start_metrics_server(config["metrics_port"])
+        if fleet:
+            await fleet.start(handle_player_deltas, counter_tracker.shard)  # before anything sends RCON commands through it
+        asyncio.create_task(unban_scheduler())  # Unban players as their bans expire
+        asyncio.create_task(reconcile_bans())  # Resend bans missing from any server
+        asyncio.create_task(update_player_stats(poll=not fleet))  # Start tracking player stats
+        asyncio.create_task(registry.watch(config.get("config_reload_interval", 5)))  # Apply config.json and servers.json edits live
 
     # Set bot status with version
     await bot.change_presence(activity=discord.Game(name=f"{bot_status} v{bot_version}"))
@@ -144,55 +199,89 @@ async def on_ready():
         print(f'Failed to sync commands: {e}')
         await log_to_console('Warning: Syncing commands failed. Use /debug for more information.')
 
+@bot.event
+async def on_app_command_completion(interaction, command):
+    elapsed = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+    command_latency.observe(command.name, value=elapsed)
+
 @bot.event
 async def on_message(message):
     if message.author == bot.user:
         return
 
-    if message.channel.id == allowed_channel_id:
-        if message.content.count('\n') == 2:
-            author_name, current_date, ban_reason = map(str.strip, message.content.split('\n'))
+    if message.channel.id == config["allowed_channel_id"]:
+        # Name/Date/Reason blocks in the message and any attached .csv/.json files.
+        # Other attachments, e.g. screenshots as evidence, are left alone.
+        entries, errors = [], []
+        if message.content.strip():
+            entries, errors = parse_ban_message(message.content)
+        ban_files = [attachment for attachment in message.attachments if is_ban_file(attachment.filename)]
+        for attachment in ban_files:
+            file_entries, file_errors = parse_ban_file(attachment.filename, await attachment.read())
+            entries += file_entries
+            errors += file_errors
+
+        if len(entries) == 1 and not errors and not ban_files:
+            author_name, current_date, ban_reason = entries[0]
             await log_message_to_github(author_name, current_date, ban_reason, message.channel)
-            await ban_user_on_all_servers(author_name)
+            results = await ban_user_on_all_servers(author_name)
+            await message.channel.send(f"Ban for {author_name} sent to servers:\n{format_server_results(results)}")
+        elif entries:
+            report = await process_bans(entries)
+            if errors:
+                report += "\nSkipped:\n" + "\n".join(errors)
+            for chunk in split_message(report):
+                await message.channel.send(chunk)
         else:
-            await message.channel.send("Invalid format. Please use the format:\nName\nDate\nReason")
+            report = "Invalid format. Please use the format:\nName\nDate\nReason"
+            if errors:
+                report += "\n" + "\n".join(errors)
+            for chunk in split_message(report):
+                await message.channel.send(chunk)
 
     await bot.process_commands(message)
 
 # Bot commands
 async def log_message_to_github(author_name, current_date, ban_reason, message_channel):
-    response = requests.get(api_url)
-    data = json.loads(response.content.decode('utf-8'))
-
-    if 'content' in data:
-        try:
-            raw_content = b64decode(data['content']).decode('utf-8')
-            messages = json.loads(raw_content)
-        except json.JSONDecodeError as e:
-            messages = {}
-    else:
-        messages = {}
-
-    messages[author_name] = {'banneduntil': current_date, 'BanReason': ban_reason}
-
-    commit_message = f"User {author_name} banned until {current_date} for reason: {ban_reason}"
-    await update_github_file(api_url, messages, commit_message)
+    ban_store.apply({author_name: {'banneduntil': current_date, 'BanReason': ban_reason}})
+    github_mirror.notify(f"User {author_name} banned until {current_date} for reason: {ban_reason}")
 
     await message_channel.send(f"Message received and processed:\nName: {author_name}\nDate: {current_date}\nReason: {ban_reason}")
 
 async def ban_user_on_all_servers(username):
     ban_command = f"ban {username}"
-    for server_name, server_details in servers.items():
-        await send_pavlov_command(server_details['ip'], server_details['port'], server_details['password'], ban_command)
+    return await ban_transport.send_to_all_servers(ban_command, servers, *rcon_limits())
+
+# Bulk bans: one ban store update and one mirror commit for all entries, then
+# every server gets all the ban commands back to back
+async def process_bans(entries):
+    entries = dedupe_bans(entries)
+    ban_store.apply({name: {'banneduntil': ban_date, 'BanReason': reason} for name, ban_date, reason in entries})
+    github_mirror.notify(f"{len(entries)} users banned: " + ", ".join(f"{name} until {ban_date} ({reason})" for name, ban_date, reason in entries))
+    results = await ban_users_on_all_servers([name for name, _, _ in entries])
+    return format_ban_report(results)
+
+async def ban_users_on_all_servers(usernames):
+    results = await ban_transport.send_commands_to_all_servers([f"ban {username}" for username in usernames], servers, *rcon_limits())
+    return {username: results[f"ban {username}"] for username in usernames}
 
 # Setup the commands from commands.py and leaderboardcmd.py
 async def setup(bot):
-    await setup_commands(bot, servers, api_url, access_token)
+    await setup_commands(bot, servers, api_url, ban_store, process_bans)
     await setup_leaderboard_commands(bot)
 
 async def main():
     await setup(bot)
-    await bot.start(config['discord_bot_token'])
+    try:
+        await bot.start(config['discord_bot_token'])
+    finally:
+        if fleet:
+            await fleet.stop()
+        await save_player_stats(force=True)
+        await github_mirror.export()
+        await ledger_client.close()
+        ban_store.close()
 
 # Run the bot
-asyncio.run(main())
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,22 +1,46 @@
 import asyncio
+import difflib
 import json
-import requests
-from base64 import b64decode
 import discord
 from discord import app_commands
-from pavlov import PavlovRCON
+from rcon import send_pavlov_command
+from player_lists import player_list_cache
+from audit import log_command
+from ban_intake import parse_ban_list, parse_ban_file, split_message
+import metrics
+from config_registry import config
 
-# Load configuration
-with open('config.json') as config_file:
-    config = json.load(config_file)
-
-required_roles = config["required_roles"]
 bot_version = config.get("bot_version", "1.0.0")
 programming_language = "Python 3.9"
-log_channel_id = config["log_channel_id"]
 
-def get_server_details(server_name, servers):
-    return servers.get(server_name)
+def resolve_server_name(server_name, servers):
+    if server_name in servers:
+        return server_name
+    folded = server_name.casefold()
+    for name in servers:
+        if name.casefold() == folded:
+            return name
+    return None
+
+def server_not_found_message(server_name, servers):
+    message = f"Server '{server_name}' not found."
+    suggestions = difflib.get_close_matches(server_name, list(servers), n=3, cutoff=0.5)
+    if suggestions:
+        message += f" Did you mean: {', '.join(suggestions)}?"
+    return message
+
+def get_server_timeout(server_name, servers):
+    return servers.get(server_name, {}).get('timeout', config.get("rcon_timeout", 10))
+
+# Acknowledge the interaction before touching RCON so a slow server cannot
+# make it expire, then wait for the server with its own timeout
+async def defer_and_wait(interaction, server_name, servers, coro):
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    try:
+        return await asyncio.wait_for(coro, get_server_timeout(server_name, servers))
+    except asyncio.TimeoutError:
+        print(f"Timed out waiting for {server_name}")
+        return None
 
 def has_required_role(user, required_roles):
     user_roles = [role.name for role in user.roles]
@@ -25,133 +49,124 @@ def has_required_role(user, required_roles):
             return True
     return False
 
-async def send_pavlov_command(host, port, password, command):
-    try:
-        pavlov = PavlovRCON(host, port, password)
-        task = asyncio.create_task(pavlov.send(command))
-        response = await task
-        print(f"Pavlov response: {response}")
-        return response if isinstance(response, str) else json.dumps(response)
-    except Exception as e:
-        print(f"Failed to send Pavlov command: {e}")
-        return None
+async def setup_commands(bot, servers, api_url, ban_store, process_bans):
+    async def server_name_autocomplete(interaction: discord.Interaction, current: str):
+        folded = current.casefold()
+        matches = [name for name in servers if name.casefold().startswith(folded)]
+        matches += [name for name in servers if folded in name.casefold() and name not in matches]
+        return [app_commands.Choice(name=name, value=name) for name in matches[:25]]
+
+    async def online_player_autocomplete(interaction: discord.Interaction, current: str):
+        return [app_commands.Choice(name=name, value=name) for name in player_list_cache.online.prefix(current, 25)]
+
+    async def banned_user_autocomplete(interaction: discord.Interaction, current: str):
+        return [app_commands.Choice(name=name, value=name) for name in ban_store.names.prefix(current, 25)]
 
-async def log_command(interaction, command_name, args):
-    log_channel = interaction.guild.get_channel(log_channel_id)
-    if log_channel:
-        embed = discord.Embed(title="Command Used", color=discord.Color.blue())
-        embed.add_field(name="User", value=interaction.user.mention, inline=True)
-        embed.add_field(name="Command", value=command_name, inline=True)
-        embed.add_field(name="Arguments", value=str(args), inline=True)
-        embed.add_field(name="Channel", value=interaction.channel.mention, inline=True)
-        embed.add_field(name="Timestamp", value=interaction.created_at.strftime("%Y-%m-%d %H:%M:%S"), inline=True)
-        await log_channel.send(embed=embed)
-
-async def setup_commands(bot, servers, api_url, access_token):
     @bot.tree.command(name="kick", description="Kick a player from a server")
     @app_commands.describe(server_name="The name of the server", player_name="The name of the player to kick")
+    @app_commands.autocomplete(server_name=server_name_autocomplete, player_name=online_player_autocomplete)
     async def kick(interaction: discord.Interaction, server_name: str, player_name: str):
         await log_command(interaction, "kick", {"server_name": server_name, "player_name": player_name})
 
-        if not has_required_role(interaction.user, required_roles):
+        if not has_required_role(interaction.user, config["required_roles"]):
             await interaction.response.send_message("You do not have the required role to use this command.", ephemeral=True)
             return
 
-        server_details = get_server_details(server_name, servers)
-        if not server_details:
-            await interaction.response.send_message(f"Server '{server_name}' not found.", ephemeral=True)
+        resolved_name = resolve_server_name(server_name, servers)
+        if not resolved_name:
+            await interaction.response.send_message(server_not_found_message(server_name, servers), ephemeral=True)
             return
+        server_name = resolved_name
 
         kick_command = f"kick {player_name}"
-        response = await send_pavlov_command(server_details['ip'], server_details['port'], server_details['password'], kick_command)
+        response = await defer_and_wait(interaction, server_name, servers, send_pavlov_command(server_name, kick_command))
         if response:
-            await interaction.response.send_message(f"Player {player_name} kicked from {server_name}.\nResponse: {response}", ephemeral=True)
+            await interaction.edit_original_response(content=f"Player {player_name} kicked from {server_name}.\nResponse: {response}")
         else:
-            await interaction.response.send_message(f"Failed to kick player {player_name} from {server_name}.", ephemeral=True)
+            await interaction.edit_original_response(content=f"Failed to kick player {player_name} from {server_name}.")
 
     @bot.tree.command(name="rotatemap", description="Rotate map on a server")
     @app_commands.describe(server_name="The name of the server")
+    @app_commands.autocomplete(server_name=server_name_autocomplete)
     async def rotatemap(interaction: discord.Interaction, server_name: str):
         await log_command(interaction, "rotatemap", {"server_name": server_name})
 
-        if not has_required_role(interaction.user, required_roles):
+        if not has_required_role(interaction.user, config["required_roles"]):
             await interaction.response.send_message("You do not have the required role to use this command.", ephemeral=True)
             return
 
-        server_details = get_server_details(server_name, servers)
-        if not server_details:
-            await interaction.response.send_message(f"Server '{server_name}' not found.", ephemeral=True)
+        resolved_name = resolve_server_name(server_name, servers)
+        if not resolved_name:
+            await interaction.response.send_message(server_not_found_message(server_name, servers), ephemeral=True)
             return
+        server_name = resolved_name
 
         rotate_command = "RotateMap"
-        response = await send_pavlov_command(server_details['ip'], server_details['port'], server_details['password'], rotate_command)
+        response = await defer_and_wait(interaction, server_name, servers, send_pavlov_command(server_name, rotate_command))
         if response:
-            await interaction.response.send_message(f"Map rotated on {server_name}.\nResponse: {response}", ephemeral=True)
+            await interaction.edit_original_response(content=f"Map rotated on {server_name}.\nResponse: {response}")
         else:
-            await interaction.response.send_message(f"Failed to rotate map on {server_name}.", ephemeral=True)
+            await interaction.edit_original_response(content=f"Failed to rotate map on {server_name}.")
 
     @bot.tree.command(name="giveitem", description="Give an item to a player")
     @app_commands.describe(server_name="The name of the server", username="The name of the player", item_id="The ID of the item to give")
+    @app_commands.autocomplete(server_name=server_name_autocomplete, username=online_player_autocomplete)
     async def giveitem(interaction: discord.Interaction, server_name: str, username: str, item_id: str):
         await log_command(interaction, "giveitem", {"server_name": server_name, "username": username, "item_id": item_id})
 
-        if not has_required_role(interaction.user, required_roles):
+        if not has_required_role(interaction.user, config["required_roles"]):
             await interaction.response.send_message("You do not have the required role to use this command.", ephemeral=True)
             return
 
-        server_details = get_server_details(server_name, servers)
-        if not server_details:
-            await interaction.response.send_message(f"Server '{server_name}' not found.", ephemeral=True)
+        resolved_name = resolve_server_name(server_name, servers)
+        if not resolved_name:
+            await interaction.response.send_message(server_not_found_message(server_name, servers), ephemeral=True)
             return
+        server_name = resolved_name
 
         give_item_command = f"giveitem {username} {item_id}"
-        response = await send_pavlov_command(server_details['ip'], server_details['port'], server_details['password'], give_item_command)
+        response = await defer_and_wait(interaction, server_name, servers, send_pavlov_command(server_name, give_item_command))
         if response:
-            await interaction.response.send_message(f"Item {item_id} given to {username} on {server_name}.\nResponse: {response}", ephemeral=True)
+            await interaction.edit_original_response(content=f"Item {item_id} given to {username} on {server_name}.\nResponse: {response}")
         else:
-            await interaction.response.send_message(f"Failed to give item {item_id} to {username} on {server_name}.", ephemeral=True)
+            await interaction.edit_original_response(content=f"Failed to give item {item_id} to {username} on {server_name}.")
 
     @bot.tree.command(name="players", description="Get the list of players on a server")
     @app_commands.describe(server_name="The name of the server")
+    @app_commands.autocomplete(server_name=server_name_autocomplete)
     async def players(interaction: discord.Interaction, server_name: str):
         await log_command(interaction, "players", {"server_name": server_name})
 
-        server_details = get_server_details(server_name, servers)
-        if not server_details:
-            await interaction.response.send_message(f"Server '{server_name}' not found.", ephemeral=True)
+        resolved_name = resolve_server_name(server_name, servers)
+        if not resolved_name:
+            await interaction.response.send_message(server_not_found_message(server_name, servers), ephemeral=True)
             return
-
-        players_command = "RefreshList"
-        response = await send_pavlov_command(server_details['ip'], server_details['port'], server_details['password'], players_command)
-        print(f"Player list response: {response}")  # Debug print
-
-        if response:
-            try:
-                player_list_data = json.loads(response)
-                player_list = player_list_data.get('PlayerList', [])
-                if player_list:
-                    formatted_player_list = "\n".join([f"{player['Username']}" for player in player_list])
-                    response_message = f"Current Players on {server_name}:\n```\n{formatted_player_list}\n```"
-                    await interaction.response.send_message(response_message, ephemeral=True)
-                else:
-                    await interaction.response.send_message(f"No players currently on server '{server_name}'.", ephemeral=True)
-            except json.JSONDecodeError:
-                await interaction.response.send_message("Failed to parse player list response.", ephemeral=True)
+        server_name = resolved_name
+
+        player_list = await defer_and_wait(interaction, server_name, servers, player_list_cache.get(server_name))
+        if player_list is None:
+            await interaction.edit_original_response(content=f"Failed to retrieve player list for server '{server_name}'.")
+        elif player_list:
+            formatted_player_list = "\n".join([f"{player['Username']}" for player in player_list])
+            response_message = f"Current Players on {server_name}:\n```\n{formatted_player_list}\n```"
+            await interaction.edit_original_response(content=response_message)
         else:
-            await interaction.response.send_message(f"Failed to retrieve player list for server '{server_name}'.", ephemeral=True)
+            await interaction.edit_original_response(content=f"No players currently on server '{server_name}'.")
 
     @bot.tree.command(name="banlist", description="Get the ban list for a server")
     @app_commands.describe(server_name="The name of the server")
+    @app_commands.autocomplete(server_name=server_name_autocomplete)
     async def banlist(interaction: discord.Interaction, server_name: str):
         await log_command(interaction, "banlist", {"server_name": server_name})
 
-        server_details = get_server_details(server_name, servers)
-        if not server_details:
-            await interaction.response.send_message(f"Server '{server_name}' not found.", ephemeral=True)
+        resolved_name = resolve_server_name(server_name, servers)
+        if not resolved_name:
+            await interaction.response.send_message(server_not_found_message(server_name, servers), ephemeral=True)
             return
+        server_name = resolved_name
 
         banlist_command = "banlist"
-        response = await send_pavlov_command(server_details['ip'], server_details['port'], server_details['password'], banlist_command)
+        response = await defer_and_wait(interaction, server_name, servers, send_pavlov_command(server_name, banlist_command))
         if response:
             try:
                 ban_list_data = json.loads(response)
@@ -159,51 +174,67 @@ async def setup_commands(bot, servers, api_url, access_token):
                 if banned_players:
                     formatted_ban_list = "\n".join(banned_players)
                     response_message = f"Banned Players on {server_name}:\n```\n{formatted_ban_list}\n```"
-                    await interaction.response.send_message(response_message, ephemeral=True)
+                    await interaction.edit_original_response(content=response_message)
                 else:
-                    await interaction.response.send_message(f"No banned players currently on server '{server_name}'.", ephemeral=True)
+                    await interaction.edit_original_response(content=f"No banned players currently on server '{server_name}'.")
             except json.JSONDecodeError:
-                await interaction.response.send_message("Failed to parse ban list response.", ephemeral=True)
+                await interaction.edit_original_response(content="Failed to parse ban list response.")
         else:
-            await interaction.response.send_message(f"Failed to retrieve ban list for server '{server_name}'.", ephemeral=True)
+            await interaction.edit_original_response(content=f"Failed to retrieve ban list for server '{server_name}'.")
 
     @bot.tree.command(name="checkunban", description="Check unban time for a specific user")
     @app_commands.describe(username="The username to check")
+    @app_commands.autocomplete(username=banned_user_autocomplete)
     async def checkunban(interaction: discord.Interaction, username: str):
         await log_command(interaction, "checkunban", {"username": username})
 
-        response = requests.get(api_url)
-        if response.status_code == 200:
-            data = json.loads(response.content.decode('utf-8'))
-
-            if 'content' in data:
-                raw_content = b64decode(data['content']).decode('utf-8')
-
-                try:
-                    banned_users = json.loads(raw_content)
-                except json.JSONDecodeError as e:
-                    await interaction.response.send_message(f"Error decoding JSON content: {e}", ephemeral=True)
-                    return
-            else:
-                await interaction.response.send_message("No 'content' field found in data.", ephemeral=True)
-                return
-        else:
-            await interaction.response.send_message(f"Failed to retrieve data from GitHub API. Status code: {response.status_code}", ephemeral=True)
-            return
-
-        if username in banned_users:
-            ban_details = banned_users[username]
+        found = ban_store.find(username)
+        if found:
+            username, ban_details = found
             banned_until = ban_details.get('banneduntil', 'N/A')
             ban_reason = ban_details.get('BanReason', 'N/A')
             await interaction.response.send_message(f"User {username} is banned until {banned_until} for reason: {ban_reason}.", ephemeral=True)
         else:
             await interaction.response.send_message(f"User {username} is not found in the ban list.", ephemeral=True)
 
+    @bot.tree.command(name="massban", description="Ban several players on all servers at once")
+    @app_commands.describe(entries="Bans as Name,Date,Reason separated by ;", file="A .csv or .json file of bans")
+    async def massban(interaction: discord.Interaction, entries: str = None, file: discord.Attachment = None):
+        await log_command(interaction, "massban", {"entries": entries, "file": file.filename if file else None})
+
+        if not has_required_role(interaction.user, config["required_roles"]):
+            await interaction.response.send_message("You do not have the required role to use this command.", ephemeral=True)
+            return
+
+        await interaction.response.defer(ephemeral=True, thinking=True)
+
+        bans, errors = [], []
+        if entries:
+            bans, errors = parse_ban_list(entries)
+        if file:
+            file_bans, file_errors = parse_ban_file(file.filename, await file.read())
+            bans += file_bans
+            errors += file_errors
+
+        if bans:
+            report = await process_bans(bans)
+            if errors:
+                report += "\nSkipped:\n" + "\n".join(errors)
+        else:
+            report = "No valid bans found. Use Name,Date,Reason entries separated by ; or attach a .csv or .json file."
+            if errors:
+                report += "\n" + "\n".join(errors)
+
+        chunks = split_message(report)
+        await interaction.edit_original_response(content=chunks[0])
+        for chunk in chunks[1:]:
+            await interaction.followup.send(chunk, ephemeral=True)
+
     @bot.tree.command(name="debug", description="DONT USE UNLESS NEEDED MAY BREAK BOT")
     async def debug(interaction: discord.Interaction):
         await log_command(interaction, "debug", {})
 
-        if not has_required_role(interaction.user, required_roles):
+        if not has_required_role(interaction.user, config["required_roles"]):
             await interaction.response.send_message("You do not have the required role to use this command.", ephemeral=True)
             return
 
@@ -222,6 +253,43 @@ async def setup_commands(bot, servers, api_url, access_token):
 
         await interaction.response.send_message(embed=embed, ephemeral=True)
 
+    @bot.tree.command(name="stats", description="Show bot performance metrics")
+    async def stats(interaction: discord.Interaction):
+        await log_command(interaction, "stats", {})
+
+        if not has_required_role(interaction.user, config["required_roles"]):
+            await interaction.response.send_message("You do not have the required role to use this command.", ephemeral=True)
+            return
+
+        def ms(seconds):
+            return "n/a" if seconds is None else f"{seconds * 1000:.0f}ms"
+
+        embed = discord.Embed(title="Bot Statistics", color=discord.Color.blue())
+
+        rcon_lines = []
+        for server_name in servers:
+            sent = metrics.rcon_commands.get(server_name)
+            errors = metrics.rcon_errors.get(server_name)
+            error_rate = f"{errors / sent:.0%}" if sent else "n/a"
+            rcon_lines.append(f"{server_name}: avg {ms(metrics.rcon_rtt.mean(server_name))}, p99 <= {ms(metrics.rcon_rtt.quantile(0.99, server_name))}, {sent} sent, {error_rate} errors")
+        embed.add_field(name="RCON", value="\n".join(rcon_lines)[:1024] or "No servers", inline=False)
+
+        command_lines = [
+            f"/{name}: p50 <= {ms(metrics.command_latency.quantile(0.5, name))}, p99 <= {ms(metrics.command_latency.quantile(0.99, name))} ({metrics.command_latency.count(name)} calls)"
+            for (name,) in metrics.command_latency.values
+        ]
+        embed.add_field(name="Commands", value="\n".join(command_lines)[:1024] or "No commands yet", inline=False)
+
+        github_calls = sum(metrics.github_requests.values.values())
+        hit_rate = metrics.etag_hit_rate()
+        remaining = metrics.github_rate_limit_remaining.get()
+        embed.add_field(name="GitHub", value=f"{github_calls} requests, ETag hit rate {'n/a' if hit_rate is None else f'{hit_rate:.0%}'}, rate limit remaining {remaining if metrics.github_rate_limit_remaining.values else 'n/a'}", inline=False)
+
+        loop_lines = [f"{name}: avg {ms(metrics.loop_duration.mean(name))} over {metrics.loop_duration.count(name)} runs" for (name,) in metrics.loop_duration.values]
+        embed.add_field(name="Background loops", value="\n".join(loop_lines) or "No runs yet", inline=False)
+
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
     @bot.tree.command(name="help", description="List all commands and their descriptions")
     async def help(interaction: discord.Interaction):
         await log_command(interaction, "help", {})
@@ -233,6 +301,8 @@ async def setup_commands(bot, servers, api_url, access_token):
         embed.add_field(name="/players", value="Get the list of players on a server. No required role", inline=False)
         embed.add_field(name="/banlist", value="Get the ban list for a server. No required role", inline=False)
         embed.add_field(name="/checkunban", value="Check unban time for a specific user. No required role", inline=False)
+        embed.add_field(name="/massban", value="Ban several players on all servers from a list or a .csv/.json file. Required role: Admin, Moderator", inline=False)
+        embed.add_field(name="/stats", value="Show RCON, command, GitHub and background loop metrics. Required role: Admin, Moderator", inline=False)
         embed.add_field(name="/debug", value="DONT USE UNLESS NEEDED MAY BREAK BOT. Required role: Admin, Moderator", inline=False)
 
         await interaction.response.send_message(embed=embed, ephemeral=True)
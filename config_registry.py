@@ -0,0 +1,75 @@
+import asyncio
+import json
+import os
+
+# config.json and servers.json, loaded once and shared by every module. The
+# dicts are updated in place on reload, so modules holding a reference always
+# see the current values. A reload is applied in one synchronous step, and
+# listeners are told which servers were added, removed or changed.
+class ConfigRegistry:
+    def __init__(self, config_path='config.json', servers_path='servers.json'):
+        self.config_path = config_path
+        self.servers_path = servers_path
+        self.config = self._read(config_path)
+        self.servers = self._read(servers_path)
+        self._validate_servers(self.servers)
+        self._mtimes = self._current_mtimes()
+        self._listeners = []
+
+    def _read(self, path):
+        with open(path) as f:
+            return json.load(f)
+
+    def _validate_servers(self, servers):
+        for server_name, server_details in servers.items():
+            missing = [key for key in ('ip', 'port', 'password') if key not in server_details]
+            if missing:
+                raise ValueError(f"Server '{server_name}' is missing {', '.join(missing)}")
+
+    def _current_mtimes(self):
+        return tuple(os.stat(path).st_mtime_ns for path in (self.config_path, self.servers_path))
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def reload(self):
+        try:
+            new_config = self._read(self.config_path)
+            new_servers = self._read(self.servers_path)
+            self._validate_servers(new_servers)
+        except (OSError, ValueError) as e:
+            print(f"Keeping the current configuration, reload failed: {e}")
+            return False
+        self.apply(new_config, new_servers)
+        return True
+
+    # Replace the current config and servers, then tell listeners what changed
+    def apply(self, new_config, new_servers):
+        added = set(new_servers) - set(self.servers)
+        removed = set(self.servers) - set(new_servers)
+        changed = {name for name in set(new_servers) & set(self.servers) if new_servers[name] != self.servers[name]}
+
+        self.config.clear()
+        self.config.update(new_config)
+        self.servers.clear()
+        self.servers.update(new_servers)
+
+        if added or removed or changed:
+            print(f"Servers reloaded: added {sorted(added)}, removed {sorted(removed)}, changed {sorted(changed)}")
+            for callback in self._listeners:
+                callback(added, removed, changed)
+
+    async def watch(self, interval=5):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                mtimes = self._current_mtimes()
+            except OSError:
+                continue
+            if mtimes != self._mtimes:
+                self._mtimes = mtimes
+                self.reload()
+
+registry = ConfigRegistry()
+config = registry.config
+servers = registry.servers
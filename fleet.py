@@ -0,0 +1,242 @@
+import asyncio
+import json
+import math
+import os
+import sys
+import zlib
+from rcon import ServerResult, rcon_pool, send_commands_to_all_servers
+from poller import stats_poller_from_config
+from stats_store import CounterTracker
+from metrics import take_forwarded, merge_forwarded
+from config_registry import config, registry, servers
+
+# Splits the servers.json fleet across worker processes (python fleet.py) that
+# own the RCON connections, poll player lists and parse RefreshList, so the
+# bot's event loop only handles Discord. Workers talk to the bot over their
+# stdin/stdout, one JSON message per line. Each worker tracks the kill and
+# death counters of its servers and only sends back what changed, plus its
+# RCON and loop metrics.
+class FleetWorkers:
+    def __init__(self, servers, workers=2, timeout=10):
+        self.servers = servers
+        self.workers = workers
+        self.timeout = timeout
+        self.handle_player_deltas = None
+        self.shard_counters = None
+        self.running = False
+        self._processes = {}  # worker_id -> asyncio subprocess
+        self._pending = {}  # request id -> (worker_id, future)
+        self._next_id = 0
+
+    # A server stays on the same worker across reloads as long as the worker count does not change
+    def owner(self, server_name):
+        return zlib.crc32(server_name.encode()) % self.workers
+
+    def shard(self, worker_id):
+        return {name: details for name, details in self.servers.items() if self.owner(name) == worker_id}
+
+    def _send(self, worker_id, message):
+        process = self._processes.get(worker_id)
+        if process is None or process.returncode is not None:
+            return False
+        process.stdin.write((json.dumps(message) + "\n").encode())
+        return True
+
+    def _send_servers(self, worker_id):
+        return self._send(worker_id, {"type": "servers", "config": config, "servers": self.shard(worker_id)})
+
+    async def _spawn(self, worker_id):
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), str(worker_id),
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, limit=2 ** 20,
+        )
+        self._processes[worker_id] = process
+        # Counters first, so the first poll continues from them
+        self._send(worker_id, {"type": "counters", "counters": self.shard_counters(set(self.shard(worker_id)))})
+        self._send_servers(worker_id)
+        asyncio.create_task(self._read(worker_id, process))
+
+    async def _read(self, worker_id, process):
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                break
+            try:
+                message = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Fleet worker {worker_id} sent an invalid message: {line[:200]!r}")
+                continue
+            if message["type"] == "stats":
+                # A failing handler must not stop this worker's results from being read
+                try:
+                    self.handle_player_deltas(message["server"], message["deltas"], message["departed"], message.get("players"))
+                except Exception as e:
+                    print(f"Failed to handle player stats from {message['server']}: {e}")
+            elif message["type"] == "metrics":
+                merge_forwarded(message["metrics"])
+            elif message["type"] == "results":
+                _, future = self._pending.get(message["id"], (None, None))
+                if future is not None and not future.done():
+                    future.set_result(message["results"])
+
+        await process.wait()
+        for request_id, (owner, future) in list(self._pending.items()):
+            if owner == worker_id and not future.done():
+                future.set_result(None)
+        if self.running and self._processes.get(worker_id) is process:
+            print(f"Fleet worker {worker_id} exited with code {process.returncode}, restarting")
+            await asyncio.sleep(5)
+            if self.running:
+                await self._spawn(worker_id)
+
+    # handle_player_deltas(server_name, deltas, departed, usernames or None) gets
+    # each poll's changes, shard_counters(server_names) the counters to seed a
+    # newly started worker with
+    async def start(self, handle_player_deltas, shard_counters):
+        self.handle_player_deltas = handle_player_deltas
+        self.shard_counters = shard_counters
+        self.running = True
+        for worker_id in range(self.workers):
+            await self._spawn(worker_id)
+
+    async def stop(self):
+        self.running = False
+        for process in self._processes.values():
+            if process.returncode is None:
+                process.stdin.close()
+        for process in self._processes.values():
+            try:
+                await asyncio.wait_for(process.wait(), self.timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+        self._processes.clear()
+
+    # Send every worker its current share of servers.json
+    def reshard(self):
+        for worker_id in self._processes:
+            self._send_servers(worker_id)
+
+    # Same results as rcon.send_commands_to_all_servers; each worker runs its
+    # own servers with up to concurrency commands in flight.
+    async def send_commands_to_all_servers(self, commands, server_names=None, concurrency=8, timeout=10):
+        server_names = list(server_names if server_names is not None else self.servers)
+        by_worker = {}
+        for server_name in server_names:
+            by_worker.setdefault(self.owner(server_name), []).append(server_name)
+        results = {command: dict.fromkeys(server_names) for command in commands}
+
+        async def run(worker_id, names):
+            self._next_id += 1
+            request_id = self._next_id
+            future = asyncio.get_running_loop().create_future()
+            self._pending[request_id] = (worker_id, future)
+            worker_results = None
+            try:
+                if self._send(worker_id, {"type": "commands", "id": request_id, "commands": commands,
+                                          "servers": names, "concurrency": concurrency, "timeout": timeout}):
+                    rounds = math.ceil(len(names) / concurrency)
+                    worker_results = await asyncio.wait_for(future, timeout * len(commands) * rounds + self.timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._pending.pop(request_id, None)
+
+            for command in commands:
+                for server_name in names:
+                    result = (worker_results or {}).get(command, {}).get(server_name)
+                    if result is None:
+                        results[command][server_name] = ServerResult(server_name, False, error=f"fleet worker {worker_id} unavailable")
+                    else:
+                        results[command][server_name] = ServerResult(server_name, *result)
+
+        await asyncio.gather(*(run(worker_id, names) for worker_id, names in by_worker.items()))
+        return results
+
+    # Same as RconPool.send: the server's response, or None if the command failed
+    async def send(self, server_name, command):
+        results = await self.send_commands_to_all_servers([command], [server_name], 1, self.timeout)
+        result = results[command][server_name]
+        return result.response if result.ok else None
+
+    async def send_to_all_servers(self, command, server_names=None, concurrency=8, timeout=10):
+        results = await self.send_commands_to_all_servers([command], server_names, concurrency, timeout)
+        return results[command]
+
+async def run_worker(worker_id):
+    out = sys.stdout
+    sys.stdout = sys.stderr  # print() output must not end up on the message channel
+
+    def emit(message):
+        out.write(json.dumps(message) + "\n")
+        out.flush()
+
+    counter_tracker = CounterTracker()
+    sent_players = {}  # server_name -> usernames the bot last got
+
+    def handle_player_list(server_name, player_list):
+        rows = [(player['Username'], player.get("Kills", 0), player.get("Deaths", 0)) for player in player_list]
+        deltas, departed = counter_tracker.update(server_name, rows)
+        message = {"type": "stats", "server": server_name, "deltas": deltas, "departed": departed}
+        usernames = {username for username, _, _ in rows}
+        if sent_players.get(server_name) != usernames:
+            sent_players[server_name] = usernames
+            message["players"] = sorted(usernames)
+        emit(message)
+
+    poller = stats_poller_from_config(config, servers, handle_player_list)
+
+    def on_servers_changed(added, removed, changed):
+        for server_name in removed:
+            poller.remove(server_name)
+            departed = counter_tracker.forget(server_name)
+            if departed:
+                emit({"type": "stats", "server": server_name, "deltas": [], "departed": departed})
+        for server_name in removed | changed:
+            sent_players.pop(server_name, None)  # the bot dropped its player list
+        if poller.running:
+            for server_name in added:
+                poller.add(server_name)
+
+    registry.add_listener(on_servers_changed)
+
+    async def forward_metrics():
+        while True:
+            await asyncio.sleep(10)
+            metrics = take_forwarded()
+            if metrics:
+                emit({"type": "metrics", "metrics": metrics})
+
+    async def run_commands(message):
+        results = await send_commands_to_all_servers(message["commands"], message["servers"], message["concurrency"], message["timeout"])
+        emit({"type": "results", "id": message["id"], "results": {
+            command: {name: [result.ok, result.response, result.error] for name, result in by_server.items()}
+            for command, by_server in results.items()
+        }})
+
+    reader = asyncio.StreamReader(limit=2 ** 20)
+    await asyncio.get_running_loop().connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    tasks = set()
+    metrics_task = asyncio.create_task(forward_metrics())
+    while True:
+        line = await reader.readline()
+        if not line:
+            break  # The bot closed stdin, shut down
+        message = json.loads(line)
+        if message["type"] == "counters":
+            counter_tracker.load({(server_name, username): (kills, deaths) for server_name, username, kills, deaths in message["counters"]})
+        elif message["type"] == "servers":
+            registry.apply(message["config"], message["servers"])
+            if not poller.running:
+                poller.start()
+                print(f"Fleet worker {worker_id} polling {len(servers)} servers")
+        elif message["type"] == "commands":
+            task = asyncio.create_task(run_commands(message))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    poller.stop()
+    metrics_task.cancel()
+    await rcon_pool.close()
+
+if __name__ == "__main__":
+    asyncio.run(run_worker(int(sys.argv[1])))
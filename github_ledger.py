@@ -0,0 +1,261 @@
+import asyncio
+import json
+from base64 import b64decode, b64encode
+import aiohttp
+from metrics import github_requests, github_rate_limit_remaining, loop_duration
+
+class GitHubError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+# Async client for the ban file stored in the GitHub contents API. One pooled
+# keep-alive session is shared by every read and write.
+class GitHubLedgerClient:
+    def __init__(self, api_url, access_token, timeout=10, retries=3):
+        self.api_url = api_url
+        self.access_token = access_token
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=self.timeout,
+                connector=aiohttp.TCPConnector(limit=10, keepalive_timeout=60),
+                headers={
+                    'Authorization': f'token {self.access_token}',
+                    'Accept': 'application/vnd.github+json',
+                },
+            )
+        return self._session
+
+    async def _request(self, method, **kwargs):
+        session = self._get_session()
+        for attempt in range(self.retries + 1):
+            try:
+                async with session.request(method, self.api_url, **kwargs) as response:
+                    github_requests.inc(method, str(response.status))
+                    if 'X-RateLimit-Remaining' in response.headers:
+                        github_rate_limit_remaining.set(value=int(response.headers['X-RateLimit-Remaining']))
+                    if response.status >= 500 and attempt < self.retries:
+                        await asyncio.sleep(2 ** attempt)
+                        continue
+                    body = await response.read()
+                    return response.status, response.headers, body
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                github_requests.inc(method, 'error')
+                if attempt == self.retries:
+                    raise GitHubError(f"GitHub request failed: {e}")
+                await asyncio.sleep(2 ** attempt)
+
+    def _decode(self, status, body):
+        data = json.loads(body.decode('utf-8'))
+        if 'content' not in data:
+            raise GitHubError("No 'content' field found in data.", status)
+
+        raw_content = b64decode(data['content']).decode('utf-8')
+        try:
+            banned_users = json.loads(raw_content) if raw_content.strip() else {}
+        except json.JSONDecodeError as e:
+            raise GitHubError(f"Error decoding JSON content: {e}", status)
+        return banned_users, data.get('sha', '')
+
+    async def read_file(self):
+        status, headers, body = await self._request('GET')
+        if status != 200:
+            raise GitHubError(f"Failed to retrieve data from GitHub API. Status code: {status}", status)
+        return self._decode(status, body)
+
+    # Returns None when the file still matches etag, otherwise (bans, sha, etag)
+    async def read_file_if_changed(self, etag=None):
+        headers = {'If-None-Match': etag} if etag else {}
+        status, response_headers, body = await self._request('GET', headers=headers)
+        if status == 304:
+            return None
+        if status != 200:
+            raise GitHubError(f"Failed to retrieve data from GitHub API. Status code: {status}", status)
+        banned_users, sha = self._decode(status, body)
+        return banned_users, sha, response_headers.get('ETag')
+
+    async def _read_sha(self):
+        status, headers, body = await self._request('GET')
+        if status == 404:
+            return None
+        if status != 200:
+            raise GitHubError(f"Failed to retrieve data from GitHub API. Status code: {status}", status)
+        return json.loads(body.decode('utf-8')).get('sha')
+
+    async def write_file(self, content, commit_message, sha=None):
+        data = {
+            'message': commit_message,
+            'content': b64encode(json.dumps(content, indent=4).encode('utf-8')).decode('utf-8'),
+        }
+        if sha is None:
+            sha = await self._read_sha()
+        if sha:
+            data['sha'] = sha
+
+        # A 409 means the sha is stale, callers must re-apply their change on
+        # top of the current file rather than overwrite someone else's commit
+        status, headers, body = await self._request('PUT', json=data)
+        if status in (200, 201):
+            return json.loads(body.decode('utf-8')).get('content', {}).get('sha')
+        raise GitHubError(f"Failed to update file on GitHub. Status code: {status}: {body.decode('utf-8', 'replace')}", status)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+# In-memory copy of the ban file. Refreshes are conditional on the last ETag,
+# so an unchanged file costs a 304 and no rate limit. Listeners are called
+# with (bans, changed) where changed is None after a full reload.
+class BanLedger:
+    def __init__(self, client):
+        self.client = client
+        self.bans = {}
+        self.sha = None
+        self.etag = None
+        self.loaded = False
+        self._listeners = []
+        self._lock = None
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def _notify(self, changed):
+        for callback in self._listeners:
+            callback(self.bans, changed)
+
+    async def refresh(self, force=False):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            try:
+                result = await self.client.read_file_if_changed(None if force else self.etag)
+            except GitHubError as e:
+                if e.status != 404:
+                    raise
+                result = ({}, None, None)
+            if result is None:
+                return False
+            self.bans, self.sha, self.etag = result
+            self.loaded = True
+            self._notify(None)
+            return True
+
+    async def ensure_loaded(self):
+        if not self.loaded:
+            await self.refresh()
+
+    def get(self, username):
+        return self.bans.get(username)
+
+    # Called after the bot's own commit so readers see it without a round trip
+    def apply_write(self, bans, sha, changed=None):
+        self.bans = bans
+        self.sha = sha
+        self.etag = None
+        self.loaded = True
+        self._notify(changed)
+
+# Exports the local ban store to the GitHub ban file in the background. Changes
+# made within one window are merged into a single commit, and a failed export
+# is retried with backoff without ever blocking the bot.
+class GitHubMirror:
+    def __init__(self, store, ledger, window=2.0, retries=3):
+        self.store = store
+        self.ledger = ledger
+        self.window = window
+        self.retries = retries
+        self._messages = []
+        self._dirty = None
+
+    def _get_dirty(self):
+        if self._dirty is None:
+            self._dirty = asyncio.Event()
+        return self._dirty
+
+    def notify(self, commit_message):
+        self._messages.append(commit_message)
+        self._get_dirty().set()
+
+    # Merge the bans already on GitHub into the store the first time it is
+    # reached. Bans made locally before that, e.g. while GitHub was down, win
+    # over GitHub's entry for the same name, and nothing is exported until
+    # then, so a partial store never overwrites ban.json.
+    async def seed_store(self):
+        if self.store.seeded:
+            return
+        await self.ledger.refresh()
+        if self.store.seeded:
+            return  # seeded by another caller while this one waited
+        missing = {username: details for username, details in self.ledger.bans.items() if username not in self.store}
+        revision = self.store.apply(missing)
+        if self.store.all() == self.ledger.bans:
+            self.store.set_mirrored_revision(revision)
+        else:
+            self._get_dirty().set()  # ban.json is missing the local bans
+        self.store.mark_seeded()
+        if missing:
+            print(f"Imported {len(missing)} bans from GitHub")
+
+    async def export(self):
+        if not self.store.seeded:
+            try:
+                await self.seed_store()
+            except GitHubError as e:
+                print(f"Failed to import bans from GitHub, not mirroring yet: {e}")
+                return False
+
+        revision = self.store.revision
+        if revision == self.store.mirrored_revision:
+            return True
+
+        snapshot = self.store.all()
+        messages, self._messages = self._messages, []
+        if len(messages) == 1:
+            commit_message = messages[0]
+        elif messages:
+            commit_message = f"{len(messages)} ban list updates\n\n" + "\n".join(messages)
+        else:
+            commit_message = "Sync ban list from the bot's ban store"
+
+        for attempt in range(self.retries + 1):
+            try:
+                await self.ledger.refresh(force=attempt > 0)
+                if self.ledger.bans == snapshot:
+                    break
+                new_sha = await self.ledger.client.write_file(snapshot, commit_message, self.ledger.sha)
+            except GitHubError as e:
+                if e.status == 409 and attempt < self.retries:
+                    continue
+                print(f"Failed to mirror ban list to GitHub: {e}")
+                self._messages[:0] = messages
+                return False
+            self.ledger.apply_write(snapshot, new_sha)
+            print(f"Updated {self.ledger.client.api_url}: {commit_message}")
+            break
+
+        self.store.set_mirrored_revision(revision)
+        return True
+
+    async def run(self):
+        dirty = self._get_dirty()
+        if self.store.revision != self.store.mirrored_revision:
+            dirty.set()
+
+        backoff = self.window
+        while True:
+            await dirty.wait()
+            await asyncio.sleep(self.window)
+            dirty.clear()
+            with loop_duration.time("github_mirror"):
+                exported = await self.export()
+            if exported:
+                backoff = self.window
+            else:
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 300)
+                dirty.set()
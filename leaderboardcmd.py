@@ -1,91 +1,162 @@
 import asyncio
-import json
-import requests
-from base64 import b64decode
+import time
 import discord
 from discord import app_commands
-from pavlov import PavlovRCON
-
-# Load configuration
-with open('config.json') as config_file:
-    config = json.load(config_file)
-
-api_url = f'https://api.github.com/repos/{config["github_username"]}/{config["repo_name"]}/contents/{config["file_path"]}'
-access_token = config["access_token"]
-log_channel_id = config["log_channel_id"]
-
-# Load server details from JSON file
-with open('servers.json') as f:
-    servers = json.load(f)
-
-player_stats = {}
-
-def get_server_details(server_name):
-    return servers.get(server_name)
-
-async def send_pavlov_command(host, port, password, command):
-    try:
-        pavlov = PavlovRCON(host, port, password)
-        task = asyncio.create_task(pavlov.send(command))
-        response = await task
-        print(f"Pavlov response: {response}")
-        return response if isinstance(response, str) else json.dumps(response)
-    except Exception as e:
-        print(f"Failed to send Pavlov command: {e}")
-        return None
-
-async def update_player_stats():
-    global player_stats
+from player_lists import player_list_cache
+from audit import log_command
+from topk import TopKIndex
+from stats_store import StatsStore, PlayerRecord, CounterTracker
+from poller import stats_poller_from_config
+from timeseries import StatsHistory, WINDOWS
+from commands import resolve_server_name, server_not_found_message
+from config_registry import config, registry, servers
+
+stats_store = StatsStore(config.get("stats_path", "player_stats"))
+stats_snapshot_interval = config.get("stats_snapshot_interval", 300)
+last_stats_snapshot = time.monotonic()
+
+player_stats = {}  # username -> PlayerRecord
+counter_tracker = CounterTracker()  # last RefreshList counters per server and player
+leaderboard_categories = ["Kills", "KD"]
+leaderboard_indexes = {category: TopKIndex(10) for category in leaderboard_categories}
+stats_history = StatsHistory(10, leaderboard_categories)  # recent kills and deaths per player and server
+
+# deltas are [username, kills_delta, deaths_delta, kills, deaths] from a CounterTracker
+def record_player_deltas(server_name, deltas, departed):
+    now = int(time.time())
+    for username, kills_delta, deaths_delta, kills, deaths in deltas:
+        stats_store.append(username, kills_delta, deaths_delta, server_name, kills, deaths, now)
+        if kills_delta or deaths_delta:
+            stats_history.record(server_name, username, kills_delta, deaths_delta, now)
+
+        stats = player_stats.get(username)
+        if stats is None:
+            stats = player_stats[username] = PlayerRecord()
+        stats.kills += kills_delta
+        stats.deaths += deaths_delta
+        for category in leaderboard_categories:
+            leaderboard_indexes[category].update(username, stats[category])
+    for username in departed:
+        stats_store.append_departure(server_name, username)
+
+def load_player_stats():
+    players, counters = stats_store.load(stats_history)
+    player_stats.update(players)
+    counter_tracker.load(counters)
+    for category in leaderboard_categories:
+        leaderboard_indexes[category].rebuild((username, stats[category]) for username, stats in player_stats.items())
+    stats_history.expire()
+
+async def save_player_stats(force=False):
+    global last_stats_snapshot
+    stats_store.flush()
+    if force or time.monotonic() - last_stats_snapshot >= stats_snapshot_interval:
+        last_stats_snapshot = time.monotonic()
+        await stats_store.save(player_stats, counter_tracker.counters, stats_history)
+
+def get_leaderboard(category):
+    return leaderboard_indexes[category].top(lambda: ((username, stats[category]) for username, stats in player_stats.items()))
+
+def handle_player_list(server_name, player_list):
+    rows = [(player['Username'], player.get("Kills", 0), player.get("Deaths", 0)) for player in player_list]
+    record_player_deltas(server_name, *counter_tracker.update(server_name, rows))
+
+# Fleet workers track the counters of their own servers and only send the
+# deltas, the departures and, when it changed, who is on the server. The bot
+# keeps a copy of the counters to persist them and to seed restarted workers.
+def handle_player_deltas(server_name, deltas, departed, usernames=None):
+    record_player_deltas(server_name, deltas, counter_tracker.apply(server_name, deltas, departed))
+    if usernames is not None:
+        player_list_cache.put(server_name, [{'Username': username} for username in usernames])
+    else:
+        player_list_cache.touch(server_name)
+
+stats_poller = stats_poller_from_config(config, servers, handle_player_list)
+
+def on_servers_changed(added, removed, changed):
+    for server_name in removed:
+        stats_poller.remove(server_name)
+        for username in counter_tracker.forget(server_name):
+            stats_store.append_departure(server_name, username)
+    if stats_poller.running:
+        for server_name in added:
+            stats_poller.add(server_name)
+
+registry.add_listener(on_servers_changed)
+
+# Buckets leaving a window are subtracted in slices, so a day rollover with
+# many active players does not hold up a poll or a /leaderboard
+async def expire_stats_history():
     while True:
-        for server_name, server_details in servers.items():
-            response = await send_pavlov_command(server_details['ip'], server_details['port'], server_details['password'], "RefreshList")
-            if response:
-                try:
-                    player_list_data = json.loads(response)
-                    player_list = player_list_data.get('PlayerList', [])
-                    for player in player_list:
-                        username = player['Username']
-                        if username not in player_stats:
-                            player_stats[username] = {
-                                "Kills": 0,
-                                "Deaths": 0,
-                                "KD": 0.0
-                            }
-                        player_stats[username]["Kills"] += player.get("Kills", 0)
-                        player_stats[username]["Deaths"] += player.get("Deaths", 0)
-                        if player_stats[username]["Deaths"] > 0:
-                            player_stats[username]["KD"] = player_stats[username]["Kills"] / player_stats[username]["Deaths"]
-                        else:
-                            player_stats[username]["KD"] = player_stats[username]["Kills"]
-                except json.JSONDecodeError:
-                    print("Failed to parse player list response.")
-        await asyncio.sleep(60)
+        stats_history.advance(time.time())
+        while stats_history.expire(2000):
+            await asyncio.sleep(0)
+        await asyncio.sleep(1)
 
-async def log_command(interaction, command_name, args):
-    log_channel = interaction.guild.get_channel(log_channel_id)
-    if log_channel:
-        embed = discord.Embed(title="Command Used", color=discord.Color.blue())
-        embed.add_field(name="User", value=interaction.user.mention, inline=True)
-        embed.add_field(name="Command", value=command_name, inline=True)
-        embed.add_field(name="Arguments", value=str(args), inline=True)
-        embed.add_field(name="Channel", value=interaction.channel.mention, inline=True)
-        embed.add_field(name="Timestamp", value=interaction.created_at.strftime("%Y-%m-%d %H:%M:%S"), inline=True)
-        await log_channel.send(embed=embed)
+async def update_player_stats(poll=True):
+    asyncio.create_task(expire_stats_history())
+    if poll:
+        stats_poller.start()
+    while True:
+        await asyncio.sleep(60)
+        try:
+            await save_player_stats()
+        except OSError as e:
+            print(f"Failed to save player stats: {e}")
 
 async def setup_leaderboard_commands(bot):
+    load_player_stats()
+
+    async def server_name_autocomplete(interaction: discord.Interaction, current: str):
+        folded = current.casefold()
+        matches = [name for name in servers if name.casefold().startswith(folded)]
+        return [app_commands.Choice(name=name, value=name) for name in matches[:25]]
+
     @bot.tree.command(name="leaderboard", description="Get the leaderboard for a specific category")
-    @app_commands.describe(category="The category for the leaderboard (Kills, KD)")
-    async def leaderboard(interaction: discord.Interaction, category: str):
-        await log_command(interaction, "leaderboard", {"category": category})
+    @app_commands.describe(
+        category="The category for the leaderboard (Kills, KD)",
+        window="The time window (all, hour, today, week, month)",
+        server_name="Only count stats from this server",
+    )
+    @app_commands.autocomplete(server_name=server_name_autocomplete)
+    async def leaderboard(interaction: discord.Interaction, category: str, window: str = "all", server_name: str = None):
+        await log_command(interaction, "leaderboard", {"category": category, "window": window, "server_name": server_name})
 
-        if category not in ["Kills", "KD"]:
+        if category not in leaderboard_categories:
             await interaction.response.send_message("Invalid category. Please choose either 'Kills' or 'KD'.", ephemeral=True)
             return
+        if window != "all" and window not in WINDOWS:
+            await interaction.response.send_message(f"Invalid window. Please choose one of: all, {', '.join(WINDOWS)}.", ephemeral=True)
+            return
+        if server_name is not None:
+            resolved_name = resolve_server_name(server_name, servers)
+            if not resolved_name:
+                await interaction.response.send_message(server_not_found_message(server_name, servers), ephemeral=True)
+                return
+            server_name = resolved_name
+            # All-time totals are only kept across servers, so a server
+            # filter uses the longest window the history covers
+            if window == "all":
+                window = "month"
 
-        sorted_stats = sorted(player_stats.items(), key=lambda x: x[1][category], reverse=True)[:10]
+        if window == "all":
+            title = f"Leaderboard - {category}"
+            rows = get_leaderboard(category)
+        else:
+            title = f"Leaderboard - {category} ({WINDOWS[window]})"
+            rows = stats_history.top(category, window, server_name)
+        if server_name is not None:
+            title += f" on {server_name}"
 
-        embed = discord.Embed(title=f"Leaderboard - {category}", color=discord.Color.gold())
-        for i, (username, stats) in enumerate(sorted_stats, start=1):
-            embed.add_field(name=f"{i}. {username}", value=f"{category}: {stats[category]}", inline=False)
+        embed = discord.Embed(title=title, color=discord.Color.gold())
+        for i, (username, value) in enumerate(rows, start=1):
+            if isinstance(value, float):
+                value = round(value, 2)
+            embed.add_field(name=f"{i}. {username}", value=f"{category}: {value}", inline=False)
+        if not rows:
+            embed.description = "No stats recorded for this window yet."
+        last_updated = player_list_cache.last_updated()
+        if last_updated is not None:
+            embed.set_footer(text=f"Updated {int(last_updated)}s ago")
 
         await interaction.response.send_message(embed=embed, ephemeral=True)
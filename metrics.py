@@ -0,0 +1,170 @@
+import time
+from aiohttp import web
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{str(value)}"' for name, value in pairs) + "}"
+
+class Counter:
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def get(self, *label_values):
+        return self.values.get(label_values, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        for label_values, value in self.values.items():
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+class Gauge(Counter):
+    def set(self, *label_values, value):
+        self.values[label_values] = value
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+class Histogram:
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}  # label values -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, *label_values, value):
+        series = self.values.get(label_values)
+        if series is None:
+            series = self.values[label_values] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        else:
+            series[len(self.buckets)] += 1
+        series[-1] += value
+
+    def time(self, *label_values):
+        return _Timer(self, label_values)
+
+    def count(self, *label_values):
+        series = self.values.get(label_values)
+        return sum(series[:-1]) if series else 0
+
+    def mean(self, *label_values):
+        count = self.count(*label_values)
+        return self.values[label_values][-1] / count if count else None
+
+    # Upper bound of the bucket holding the given quantile
+    def quantile(self, q, *label_values):
+        series = self.values.get(label_values)
+        count = self.count(*label_values)
+        if not count:
+            return None
+        seen = 0
+        for i, bound in enumerate(self.buckets):
+            seen += series[i]
+            if seen >= q * count:
+                return bound
+        return float('inf')
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for label_values, series in self.values.items():
+            cumulative = 0
+            for i, bound in enumerate(self.buckets):
+                cumulative += series[i]
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, [('le', bound)])} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, [('le', '+Inf')])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, label_values)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, label_values)} {cumulative}")
+        return lines
+
+class _Timer:
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(*self.label_values, value=time.perf_counter() - self.started)
+
+rcon_rtt = Histogram("pavlov_rcon_rtt_seconds", "RCON command round trip time", ("server",))
+rcon_commands = Counter("pavlov_rcon_commands_total", "RCON commands sent", ("server",))
+rcon_errors = Counter("pavlov_rcon_errors_total", "RCON commands that failed", ("server",))
+command_latency = Histogram("discord_command_latency_seconds", "Slash command latency from interaction to completion", ("command",))
+github_requests = Counter("github_requests_total", "GitHub API requests", ("method", "status"))
+github_rate_limit_remaining = Gauge("github_rate_limit_remaining", "GitHub API requests left in the current window")
+loop_duration = Histogram("bot_loop_duration_seconds", "Duration of one background loop iteration", ("loop",), (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60))
+
+registry = [rcon_rtt, rcon_commands, rcon_errors, command_latency, github_requests, github_rate_limit_remaining, loop_duration]
+
+# Recorded by fleet workers too; each worker sends what it recorded since its
+# last report and the bot adds it to its own values
+forwarded = [rcon_rtt, rcon_commands, rcon_errors, loop_duration]
+
+def take_forwarded():
+    data = {}
+    for metric in forwarded:
+        if metric.values:
+            data[metric.name] = [[list(label_values), value] for label_values, value in metric.values.items()]
+            metric.values = {}
+    return data
+
+def merge_forwarded(data):
+    by_name = {metric.name: metric for metric in forwarded}
+    for name, series in data.items():
+        metric = by_name.get(name)
+        if metric is None:
+            continue
+        for label_values, value in series:
+            label_values = tuple(label_values)
+            if isinstance(metric, Histogram):
+                current = metric.values.get(label_values)
+                metric.values[label_values] = [a + b for a, b in zip(current, value)] if current else value
+            else:
+                metric.inc(*label_values, amount=value)
+
+# Called before each render so values owned by other modules stay current
+collectors = []
+
+def render():
+    for collect in collectors:
+        collect()
+    lines = []
+    for metric in registry:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+def etag_hit_rate():
+    gets = sum(value for (method, status), value in github_requests.values.items() if method == 'GET')
+    return github_requests.get('GET', '304') / gets if gets else None
+
+async def start_metrics_server(port, host='127.0.0.1'):
+    async def handle_metrics(request):
+        return web.Response(text=render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Metrics available on http://{host}:{port}/metrics")
+    return runner
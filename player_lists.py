@@ -0,0 +1,90 @@
+import asyncio
+import json
+import time
+from rcon import send_pavlov_command
+from name_index import NameIndex
+from config_registry import config, registry
+
+# Shared RefreshList snapshots per server. Readers within the TTL get the
+# cached list, and concurrent misses for a server share one RCON call.
+class PlayerListCache:
+    def __init__(self, ttl=15, send=send_pavlov_command):
+        self.ttl = ttl
+        self.send = send
+        self._snapshots = {}  # server_name -> (fetched_at, player_list)
+        self._inflight = {}
+        self.online = NameIndex()  # players on any server in the latest snapshots
+        self._online_counts = {}
+
+    async def _fetch(self, server_name):
+        response = await self.send(server_name, "RefreshList")
+        if not response:
+            return None
+        try:
+            player_list = json.loads(response).get('PlayerList', [])
+        except json.JSONDecodeError:
+            print("Failed to parse player list response.")
+            return None
+        self.put(server_name, player_list)
+        return player_list
+
+    def put(self, server_name, player_list):
+        previous = self._snapshots.get(server_name)
+        self._snapshots[server_name] = (time.monotonic(), player_list)
+        self._update_online(previous[1] if previous else [], player_list)
+
+    # The server's players are unchanged since the last put
+    def touch(self, server_name):
+        snapshot = self._snapshots.get(server_name)
+        if snapshot:
+            self._snapshots[server_name] = (time.monotonic(), snapshot[1])
+
+    def _update_online(self, old_list, new_list):
+        old_names = {player['Username'] for player in old_list}
+        new_names = {player['Username'] for player in new_list}
+        for name in new_names - old_names:
+            self._online_counts[name] = self._online_counts.get(name, 0) + 1
+            if self._online_counts[name] == 1:
+                self.online.add(name)
+        for name in old_names - new_names:
+            self._online_counts[name] -= 1
+            if not self._online_counts[name]:
+                del self._online_counts[name]
+                self.online.remove(name)
+
+    # Returns the server's player list, or None if it could not be fetched
+    async def get(self, server_name, max_age=None):
+        max_age = self.ttl if max_age is None else max_age
+        snapshot = self._snapshots.get(server_name)
+        if snapshot and time.monotonic() - snapshot[0] <= max_age:
+            return snapshot[1]
+
+        task = self._inflight.get(server_name)
+        if task is None:
+            task = asyncio.create_task(self._fetch(server_name))
+            self._inflight[server_name] = task
+            task.add_done_callback(lambda _: self._inflight.pop(server_name, None))
+        # Shielded so one caller timing out does not cancel the others
+        return await asyncio.shield(task)
+
+    def age(self, server_name):
+        snapshot = self._snapshots.get(server_name)
+        return time.monotonic() - snapshot[0] if snapshot else None
+
+    def last_updated(self):
+        if not self._snapshots:
+            return None
+        return min(time.monotonic() - fetched_at for fetched_at, _ in self._snapshots.values())
+
+    def forget(self, server_name):
+        snapshot = self._snapshots.pop(server_name, None)
+        if snapshot:
+            self._update_online(snapshot[1], [])
+
+player_list_cache = PlayerListCache(config.get("player_list_ttl", 15))
+
+def on_servers_changed(added, removed, changed):
+    for server_name in removed | changed:
+        player_list_cache.forget(server_name)
+
+registry.add_listener(on_servers_changed)
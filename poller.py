@@ -0,0 +1,106 @@
+import asyncio
+import random
+import time
+from player_lists import player_list_cache
+from metrics import loop_duration
+
+class PollState:
+    __slots__ = ('interval', 'failures', 'players', 'last_poll')
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.failures = 0
+        self.players = None
+        self.last_poll = None
+
+# Polls every server's player list on its own schedule so a slow or dead
+# server never holds up the others. Busy servers are polled more often, empty
+# ones less, and unreachable ones back off exponentially. Every delay gets
+# some jitter so the fleet does not poll in lockstep.
+class StatsPoller:
+    def __init__(self, servers, handle_player_list, interval=60, min_interval=20, max_interval=180,
+                 offline_max_interval=600, timeout=10, busy_players=10, jitter=0.1):
+        self.servers = servers
+        self.handle_player_list = handle_player_list
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.offline_max_interval = offline_max_interval
+        self.timeout = timeout
+        self.busy_players = busy_players
+        self.jitter = jitter
+        self.states = {}
+        self.running = False
+        self._tasks = {}
+
+    def next_interval(self, server_name, state):
+        if state.failures:
+            return min(self.interval * 2 ** state.failures, self.offline_max_interval)
+        if not state.players:
+            return self.max_interval
+        busy_players = self.servers.get(server_name, {}).get('max_players', self.busy_players)
+        fill = min(state.players / busy_players, 1.0)
+        return self.interval - (self.interval - self.min_interval) * fill
+
+    async def poll(self, server_name):
+        state = self.states.setdefault(server_name, PollState(self.interval))
+        with loop_duration.time("stats_poll"):
+            try:
+                player_list = await asyncio.wait_for(player_list_cache.get(server_name), self.timeout)
+            except asyncio.TimeoutError:
+                player_list = None
+
+        state.last_poll = time.monotonic()
+        if player_list is None:
+            state.failures += 1
+            state.players = None
+        else:
+            state.failures = 0
+            state.players = len(player_list)
+            self.handle_player_list(server_name, player_list)
+        state.interval = self.next_interval(server_name, state)
+        return state.interval
+
+    async def _run(self, server_name):
+        # Spread the first polls over one interval instead of firing them together
+        await asyncio.sleep(random.uniform(0, self.interval * self.jitter * 2))
+        while True:
+            try:
+                delay = await self.poll(server_name)
+            except Exception as e:
+                print(f"Failed to poll {server_name}: {e}")
+                delay = self.interval
+            await asyncio.sleep(delay * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def add(self, server_name):
+        task = self._tasks.get(server_name)
+        if task is None or task.done():
+            self._tasks[server_name] = asyncio.create_task(self._run(server_name))
+
+    def remove(self, server_name):
+        task = self._tasks.pop(server_name, None)
+        if task is not None:
+            task.cancel()
+        self.states.pop(server_name, None)
+
+    def start(self):
+        self.running = True
+        for server_name in self.servers:
+            self.add(server_name)
+
+    def stop(self):
+        self.running = False
+        for server_name in list(self._tasks):
+            self.remove(server_name)
+
+def stats_poller_from_config(config, servers, handle_player_list):
+    return StatsPoller(
+        servers,
+        handle_player_list,
+        interval=config.get("stats_poll_interval", 60),
+        min_interval=config.get("stats_poll_min_interval", 20),
+        max_interval=config.get("stats_poll_max_interval", 180),
+        offline_max_interval=config.get("stats_poll_offline_max_interval", 600),
+        timeout=config.get("rcon_timeout", 10),
+        busy_players=config.get("stats_busy_players", 10),
+    )
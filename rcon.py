@@ -0,0 +1,191 @@
+import asyncio
+import json
+from dataclasses import dataclass
+from pavlov import PavlovRCON
+from metrics import rcon_rtt, rcon_commands, rcon_errors
+from config_registry import config, registry, servers
+
+# Keeps one authenticated PavlovRCON connection per servers.json entry and
+# serializes the commands sent to each server. A command gets one timeout for
+# everything, waiting for the connection, the reply and the retry.
+class RconPool:
+    def __init__(self, servers, timeout=10, max_response=4 * 1024 * 1024):
+        self.servers = servers
+        self.timeout = timeout
+        self.max_response = max_response
+        self._connections = {}
+        self._locks = {}
+
+    def _lock(self, server_name):
+        if server_name not in self._locks:
+            self._locks[server_name] = asyncio.Lock()
+        return self._locks[server_name]
+
+    def _connection(self, server_name):
+        pavlov = self._connections.get(server_name)
+        if pavlov is None:
+            server_details = self.servers[server_name]
+            pavlov = PavlovRCON(server_details['ip'], server_details['port'], server_details['password'], timeout=self.timeout)
+            self._connections[server_name] = pavlov
+        return pavlov
+
+    async def _drop(self, server_name):
+        pavlov = self._connections.pop(server_name, None)
+        if pavlov is not None:
+            try:
+                await pavlov.close()
+            except Exception:
+                pass
+
+    # One command and its whole reply. async-pavlov's own send waits 100 ms
+    # for stale bytes before every command and reads at most 4096 bytes of the
+    # reply. A pooled connection has no stale bytes, since replies are always
+    # read to the end and a connection is dropped when one is not, so the
+    # command is written directly and the reply read until it parses.
+    async def _exchange(self, pavlov, command, deadline):
+        loop = asyncio.get_running_loop()
+        await asyncio.wait_for(pavlov.open(), max(deadline - loop.time(), 0))
+        pavlov.writer.write(command.encode())
+        await asyncio.wait_for(pavlov.writer.drain(), max(deadline - loop.time(), 0))
+        data = b''
+        while len(data) < self.max_response:
+            chunk = await asyncio.wait_for(pavlov.reader.read(65536), max(deadline - loop.time(), 0))
+            if not chunk:
+                raise ConnectionError("connection closed by the server")
+            data += chunk
+            try:
+                return json.loads(data.decode())
+            except (UnicodeDecodeError, json.JSONDecodeError):
+                continue
+        raise ValueError(f"incomplete response ({len(data)} bytes)")
+
+    async def _send(self, server_name, command, deadline):
+        async with self._lock(server_name):
+            # A pooled connection may have been closed by the server since the
+            # last command, so retry once on a fresh connection if there is
+            # time left
+            rcon_commands.inc(server_name)
+            for attempt in range(2):
+                pavlov = self._connection(server_name)
+                try:
+                    with rcon_rtt.time(server_name):
+                        response = await self._exchange(pavlov, command, deadline)
+                    print(f"Pavlov response: {response}")
+                    return json.dumps(response)
+                except asyncio.CancelledError:
+                    # A half-read response would desync the next command on this connection
+                    rcon_errors.inc(server_name)
+                    await self._drop(server_name)
+                    raise
+                except Exception as e:
+                    await self._drop(server_name)
+                    if asyncio.get_running_loop().time() >= deadline:
+                        rcon_errors.inc(server_name)
+                        raise asyncio.TimeoutError()
+                    if attempt == 1:
+                        rcon_errors.inc(server_name)
+                        print(f"Failed to send Pavlov command: {e}")
+        return None
+
+    # The server's response, or None if the command failed. timeout defaults
+    # to the server's own timeout in servers.json, then the pool's. Raises
+    # asyncio.TimeoutError when it runs out.
+    async def send_within(self, server_name, command, timeout=None):
+        if server_name not in self.servers:
+            print(f"Unknown server: {server_name}")
+            return None
+        if timeout is None:
+            timeout = self.servers[server_name].get('timeout', self.timeout)
+        deadline = asyncio.get_running_loop().time() + timeout
+        return await asyncio.wait_for(self._send(server_name, command, deadline), timeout)
+
+    async def send(self, server_name, command, timeout=None):
+        try:
+            return await self.send_within(server_name, command, timeout)
+        except asyncio.TimeoutError:
+            print(f"Timed out sending Pavlov command to {server_name}")
+            return None
+
+    # Stop using a server's connection right away; the old one is closed in the background
+    def discard(self, server_name):
+        pavlov = self._connections.pop(server_name, None)
+        if pavlov is not None:
+            asyncio.create_task(pavlov.close())
+
+    async def close(self, server_name=None):
+        server_names = [server_name] if server_name else list(self._connections)
+        for name in server_names:
+            async with self._lock(name):
+                await self._drop(name)
+
+rcon_pool = RconPool(servers, config.get("rcon_timeout", 10))
+
+def on_servers_changed(added, removed, changed):
+    for server_name in removed | changed:
+        rcon_pool.discard(server_name)
+
+registry.add_listener(on_servers_changed)
+
+async def send_pavlov_command(server_name, command):
+    return await rcon_pool.send(server_name, command)
+
+@dataclass
+class ServerResult:
+    server_name: str
+    ok: bool
+    response: str = None
+    error: str = None
+
+async def send_to_all_servers(command, server_names=None, concurrency=8, timeout=10):
+    server_names = list(server_names if server_names is not None else rcon_pool.servers)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send_one(server_name):
+        async with semaphore:
+            try:
+                response = await rcon_pool.send_within(server_name, command, timeout)
+            except asyncio.TimeoutError:
+                return ServerResult(server_name, False, error=f"timed out after {timeout}s")
+            if response is None:
+                return ServerResult(server_name, False, error="no response")
+            return ServerResult(server_name, True, response=response)
+
+    results = await asyncio.gather(*(send_one(server_name) for server_name in server_names))
+    return {result.server_name: result for result in results}
+
+# Sends a list of commands to every server. Servers run concurrently, and each
+# one gets the commands back to back over its pooled connection, one round
+# trip per command: Pavlov RCON has no framing that would let it tell apart
+# commands written before the previous reply. Returns
+# {command: {server_name: ServerResult}}.
+async def send_commands_to_all_servers(commands, server_names=None, concurrency=8, timeout=10):
+    server_names = list(server_names if server_names is not None else rcon_pool.servers)
+    semaphore = asyncio.Semaphore(concurrency)
+    results = {command: {} for command in commands}
+
+    async def send_all(server_name):
+        async with semaphore:
+            for i, command in enumerate(commands):
+                try:
+                    response = await rcon_pool.send_within(server_name, command, timeout)
+                except asyncio.TimeoutError:
+                    # The server is most likely down, don't wait on it for every command
+                    results[command][server_name] = ServerResult(server_name, False, error=f"timed out after {timeout}s")
+                    for skipped in commands[i + 1:]:
+                        results[skipped][server_name] = ServerResult(server_name, False, error="skipped, server timed out")
+                    return
+                if response is None:
+                    results[command][server_name] = ServerResult(server_name, False, error="no response")
+                else:
+                    results[command][server_name] = ServerResult(server_name, True, response=response)
+
+    await asyncio.gather(*(send_all(server_name) for server_name in server_names))
+    return results
+
+def format_server_results(results):
+    succeeded = [name for name, result in results.items() if result.ok]
+    failed = [f"{name} ({result.error})" for name, result in results.items() if not result.ok]
+    lines = [f"Succeeded on {len(succeeded)}/{len(results)} servers: {', '.join(succeeded) or 'none'}"]
+    if failed:
+        lines.append(f"Failed on: {', '.join(failed)}")
+    return "\n".join(lines)
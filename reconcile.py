@@ -0,0 +1,93 @@
+import asyncio
+import json
+import time
+from rcon import rcon_pool
+
+# Brings each server's banlist in line with the ban store. Only the missing
+# bans are sent, plus unbans for names the bot itself lifted a ban on. Bans
+# added in game or by other tools are left alone unless unban_unlisted is set.
+# A server whose banlist and the store are both unchanged since its last pass
+# is skipped without diffing.
+class BanReconciler:
+    def __init__(self, store, concurrency=8, timeout=10, unban_unlisted=False, removed_ttl=30 * 86400, send=None, unlisted_ratio=0.5):
+        self.store = store
+        self.send = send or rcon_pool.send
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.unban_unlisted = unban_unlisted
+        self.removed_ttl = removed_ttl
+        self.unlisted_ratio = unlisted_ratio
+        self._desired = None
+        self._removed = None
+        self._desired_revision = None
+        self._last_state = {}  # server_name -> (store revision, banlist after the last pass)
+
+    def _desired_bans(self):
+        revision = self.store.revision
+        if self._desired is None or revision != self._desired_revision:
+            self.store.prune_removed(time.time() - self.removed_ttl)
+            self._desired = frozenset(self.store.usernames())
+            self._removed = frozenset(self.store.removed_usernames())
+            self._desired_revision = revision
+        return self._desired, self._removed, revision
+
+    async def _send(self, server_name, command):
+        try:
+            return await asyncio.wait_for(self.send(server_name, command), self.timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def reconcile_server(self, server_name, desired, removed, revision):
+        response = await self._send(server_name, "banlist")
+        if not response:
+            return None
+        try:
+            current = frozenset(json.loads(response).get('BanList', []))
+        except json.JSONDecodeError:
+            print(f"Failed to parse ban list response from {server_name}.")
+            return None
+
+        if self._last_state.get(server_name) == (revision, current):
+            return 0, 0
+
+        missing = desired - current
+        stale = current & removed
+        if self.unban_unlisted:
+            if len(desired) >= len(current) * self.unlisted_ratio:
+                stale = current - desired
+            else:
+                print(f"Not removing unlisted bans on {server_name}: the ban store has {len(desired)} bans, the server {len(current)}")
+        banned, unbanned = set(), set()
+        for username in missing:
+            if await self._send(server_name, f"ban {username}") is not None:
+                banned.add(username)
+        for username in stale:
+            if await self._send(server_name, f"unban {username}") is not None:
+                unbanned.add(username)
+
+        self._last_state[server_name] = (revision, (current | banned) - unbanned)
+        return len(banned), len(unbanned)
+
+    async def run_once(self, server_names=None):
+        # Until GitHub's ban list is merged in, the store only holds recent bans
+        if not self.store.seeded:
+            print("Ban reconciliation skipped: the ban store has not been seeded yet")
+            return {}
+        server_names = list(server_names if server_names is not None else rcon_pool.servers)
+        desired, removed, revision = self._desired_bans()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_server(server_name):
+            async with semaphore:
+                return server_name, await self.reconcile_server(server_name, desired, removed, revision)
+
+        results = dict(await asyncio.gather(*(run_server(server_name) for server_name in server_names)))
+        for server_name, result in results.items():
+            if result is None:
+                print(f"Ban reconciliation skipped {server_name}: no ban list")
+            elif any(result):
+                print(f"Ban reconciliation on {server_name}: {result[0]} bans and {result[1]} unbans sent")
+        return results
+
+    def forget(self, server_name):
+        self._last_state.pop(server_name, None)
@@ -0,0 +1,238 @@
+import asyncio
+import json
+import os
+
+class PlayerRecord:
+    __slots__ = ('kills', 'deaths')
+
+    def __init__(self, kills=0, deaths=0):
+        self.kills = kills
+        self.deaths = deaths
+
+    @property
+    def kd(self):
+        return self.kills / self.deaths if self.deaths > 0 else self.kills
+
+    def __getitem__(self, category):
+        if category == "Kills":
+            return self.kills
+        if category == "Deaths":
+            return self.deaths
+        if category == "KD":
+            return self.kd
+        raise KeyError(category)
+
+# Turns RefreshList counters into per-player deltas. RefreshList reports
+# totals for the current match, so only the increase since the last poll
+# counts, and counters going down means a new match started. A player missing
+# from a server's list left the match, so their counters there start again
+# from zero when they come back.
+class CounterTracker:
+    def __init__(self):
+        self.counters = {}  # (server_name, username) -> (kills, deaths) from the last RefreshList
+        self.server_players = {}  # server_name -> usernames in its last RefreshList
+
+    def load(self, counters):
+        for (server_name, username), value in counters.items():
+            self.counters[(server_name, username)] = tuple(value)
+            self.server_players.setdefault(server_name, set()).add(username)
+
+    # rows are (username, kills, deaths). Returns the players whose counters
+    # went up as [username, kills_delta, deaths_delta, kills, deaths], and the
+    # players that left the server.
+    def update(self, server_name, rows):
+        deltas = []
+        usernames = set()
+        for username, kills, deaths in rows:
+            usernames.add(username)
+            last_kills, last_deaths = self.counters.get((server_name, username), (0, 0))
+            if kills < last_kills or deaths < last_deaths:
+                last_kills, last_deaths = 0, 0
+            self.counters[(server_name, username)] = (kills, deaths)
+            if kills != last_kills or deaths != last_deaths:
+                deltas.append([username, kills - last_kills, deaths - last_deaths, kills, deaths])
+        departed = self._set_players(server_name, usernames)
+        return deltas, departed
+
+    def _set_players(self, server_name, usernames):
+        departed = [username for username in self.server_players.get(server_name, ()) if username not in usernames]
+        for username in departed:
+            self.counters.pop((server_name, username), None)
+        if usernames:
+            self.server_players[server_name] = usernames
+        else:
+            self.server_players.pop(server_name, None)
+        return departed
+
+    # Mirrors the deltas and departures computed by another tracker, e.g. in a
+    # fleet worker. Returns the departed players this tracker had counters for.
+    def apply(self, server_name, deltas, departed):
+        players = self.server_players.setdefault(server_name, set())
+        for username, _, _, kills, deaths in deltas:
+            self.counters[(server_name, username)] = (kills, deaths)
+            players.add(username)
+        known = []
+        for username in departed:
+            players.discard(username)
+            if self.counters.pop((server_name, username), None) is not None:
+                known.append(username)
+        if not players:
+            del self.server_players[server_name]
+        return known
+
+    def forget(self, server_name):
+        return self._set_players(server_name, set())
+
+    def shard(self, server_names):
+        return [[server_name, username, kills, deaths] for (server_name, username), (kills, deaths) in self.counters.items() if server_name in server_names]
+
+# Player stats on disk as a snapshot plus an append-only journal of deltas.
+# The journal starts with the generation of the snapshot it follows, so a
+# crash between writing a snapshot and truncating the journal never replays
+# the same deltas twice. While a snapshot is written in a thread, new deltas
+# go to a second journal for the next generation, which replaces the first
+# once the snapshot is on disk.
+class StatsStore:
+    def __init__(self, path='player_stats'):
+        self.snapshot_path = f'{path}.snapshot'
+        self.journal_path = f'{path}.journal'
+        self.next_journal_path = f'{path}.journal.next'
+        self.generation = 0
+        self.journal_entries = 0
+        self._journal = None
+        self._lock = None
+
+    # history, if given, gets the windowed history from the snapshot and every
+    # timestamped journal entry after it
+    def load(self, history=None):
+        players = {}
+        counters = {}
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+            self.generation = snapshot['generation']
+            for username, (kills, deaths) in snapshot['players'].items():
+                players[username] = PlayerRecord(kills, deaths)
+            for server_name, username, kills, deaths in snapshot['counters']:
+                counters[(server_name, username)] = (kills, deaths)
+            if history is not None and 'history' in snapshot:
+                history.load(snapshot['history'])
+
+        # A next journal left by a crash during a snapshot follows the journal
+        # if the snapshot was not replaced yet, and replaces it if it was
+        replayed, torn = self._replay(self.journal_path, (self.generation,), players, counters, history)
+        interrupted = os.path.exists(self.next_journal_path)
+        if interrupted:
+            next_replayed, next_torn = self._replay(self.next_journal_path, (self.generation, self.generation + 1), players, counters, history)
+            replayed += next_replayed
+            torn = torn or next_torn
+
+        self.journal_entries = replayed
+        self._journal = open(self.journal_path, 'a')
+        if replayed == 0:
+            self._journal.truncate(0)
+            self._journal.write(f'{self.generation}\n')
+        if torn or interrupted:
+            self.snapshot(players, counters, history)
+        print(f"Loaded stats for {len(players)} players ({replayed} journal entries replayed)")
+        return players, counters
+
+    # Returns (entries replayed, whether the file ended in a torn line)
+    def _replay(self, path, generations, players, counters, history):
+        replayed = 0
+        if not os.path.exists(path):
+            return replayed, False
+        with open(path) as f:
+            header = f.readline().strip()
+            if header not in [str(generation) for generation in generations]:
+                return replayed, False
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    if len(entry) == 2:
+                        counters.pop(tuple(entry), None)  # player left the server
+                        replayed += 1
+                        continue
+                    username, kills_delta, deaths_delta, server_name, kills, deaths = entry[:6]
+                except ValueError:
+                    return replayed, True  # last line cut short by a crash
+                if history is not None and len(entry) > 6 and (kills_delta or deaths_delta):
+                    history.record(server_name, username, kills_delta, deaths_delta, entry[6])
+                record = players.get(username)
+                if record is None:
+                    record = players[username] = PlayerRecord()
+                record.kills += kills_delta
+                record.deaths += deaths_delta
+                counters[(server_name, username)] = (kills, deaths)
+                replayed += 1
+        return replayed, False
+
+    def append(self, username, kills_delta, deaths_delta, server_name, kills, deaths, at):
+        self._journal.write(json.dumps([username, kills_delta, deaths_delta, server_name, kills, deaths, at], separators=(',', ':')) + '\n')
+        self.journal_entries += 1
+
+    def append_departure(self, server_name, username):
+        self._journal.write(json.dumps([server_name, username], separators=(',', ':')) + '\n')
+        self.journal_entries += 1
+
+    def flush(self):
+        if self._journal is not None:
+            self._journal.flush()
+
+    # Copies everything the snapshot needs, so it can be written while the
+    # stats keep changing
+    def _build(self, players, counters, history):
+        snapshot = {
+            'generation': self.generation + 1,
+            'players': {username: [record.kills, record.deaths] for username, record in players.items()},
+            'counters': [[server_name, username, kills, deaths] for (server_name, username), (kills, deaths) in counters.items()],
+        }
+        if history is not None:
+            snapshot['history'] = history.dump()
+        return snapshot
+
+    def _write(self, snapshot):
+        tmp_path = f'{self.snapshot_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+    def _open_journal(self, path, generation):
+        self._journal.close()
+        self._journal = open(path, 'w')
+        self._journal.write(f'{generation}\n')
+        self._journal.flush()
+        self.journal_entries = 0
+
+    # Blocks while the snapshot is written, for startup and shutdown
+    def snapshot(self, players, counters, history=None):
+        snapshot = self._build(players, counters, history)
+        self._write(snapshot)
+        self.generation = snapshot['generation']
+        self._open_journal(self.journal_path, self.generation)
+        if os.path.exists(self.next_journal_path):
+            os.remove(self.next_journal_path)
+
+    # Same as snapshot, but the JSON encoding and fsync run in a thread so the
+    # event loop keeps serving commands. Deltas recorded meanwhile go to the
+    # next journal.
+    async def save(self, players, counters, history=None):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self.flush()
+            snapshot = self._build(players, counters, history)
+            # After a failed write the next journal is already open and holds deltas since then
+            if self._journal.name != self.next_journal_path:
+                self._open_journal(self.next_journal_path, snapshot['generation'])
+            await asyncio.to_thread(self._write, snapshot)
+            self.flush()
+            os.replace(self.next_journal_path, self.journal_path)
+            self.generation = snapshot['generation']
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
@@ -0,0 +1,163 @@
+import time
+from collections import deque
+from datetime import date
+from stats_store import PlayerRecord
+from topk import TopKIndex
+
+# Kills and deaths are kept packed into one int, kills in the high bits, so a
+# total is a single small object and bucket totals add and subtract directly.
+DEATHS_MASK = (1 << 32) - 1
+
+def pack(kills, deaths):
+    return (kills << 32) | deaths
+
+def unpack(packed):
+    return packed >> 32, packed & DEATHS_MASK
+
+WINDOWS = {
+    "hour": "Last hour",
+    "today": "Today",
+    "week": "Last 7 days",
+    "month": "Last 30 days",
+}
+DAY_WINDOWS = {"today": 1, "week": 7, "month": 30}  # window -> days covered, including today
+
+# Recent kills and deaths per player, per server and across all servers.
+# Deltas go into sparse minute and day buckets that only hold the players
+# active in them, and into running totals for every window. When a bucket
+# leaves a window its totals are subtracted, and players left at zero are
+# dropped, so memory follows recent activity and a query only reads a top-K
+# index instead of every player. Subtracting a day bucket touches every
+# player active that day, so advance only queues it and expire works through
+# the queue in slices.
+#
+# There is no hour tier between minutes and days: "today" is the calendar
+# day, which is exactly one day bucket, and the hour window is served from
+# minute buckets.
+class StatsHistory:
+    def __init__(self, leaderboard_size=10, categories=("Kills", "KD")):
+        self.leaderboard_size = leaderboard_size
+        self.categories = categories
+        self.minutes = {}  # minute number -> {server_name: {username: packed}}
+        self.days = {}  # date ordinal -> {server_name: {username: packed}}
+        self.totals = {window: {} for window in WINDOWS}  # window -> {server_name or None: {username: packed}}
+        self._indexes = {}  # (window, server_name or None, category) -> TopKIndex
+        self._expiring = deque()  # (window, server_name, iterator of (username, packed)) still to subtract
+        self._minute = None
+        self._day = None
+
+    def _in_window(self, window, minute, day):
+        if window == "hour":
+            return minute > self._minute - 60
+        return day > self._day - DAY_WINDOWS[window]
+
+    def _add(self, window, scope, username, packed):
+        totals = self.totals[window].setdefault(scope, {})
+        total = totals.get(username, 0) + packed
+        if total:
+            totals[username] = total
+        else:
+            totals.pop(username, None)
+        for category in self.categories:
+            index = self._indexes.get((window, scope, category))
+            if index is None:
+                index = self._indexes[(window, scope, category)] = TopKIndex(self.leaderboard_size)
+            if total:
+                index.update(username, PlayerRecord(*unpack(total))[category])
+            else:
+                index.remove(username)
+        if not totals:
+            del self.totals[window][scope]
+            for category in self.categories:
+                self._indexes.pop((window, scope, category), None)
+
+    def _add_bucket(self, window, bucket):
+        for server_name, players in bucket.items():
+            for username, packed in players.items():
+                self._add(window, None, username, packed)
+                self._add(window, server_name, username, packed)
+
+    # The bucket is copied, a late delta may still be added to it
+    def _queue_expiry(self, window, bucket):
+        for server_name, players in bucket.items():
+            self._expiring.append((window, server_name, iter(list(players.items()))))
+
+    def advance(self, now):
+        minute, day = int(now // 60), date.fromtimestamp(now).toordinal()
+        if self._minute is None:
+            self._minute, self._day = minute, day
+            return
+        if minute > self._minute:
+            for bucket_minute in [m for m in self.minutes if m <= minute - 60]:
+                self._queue_expiry("hour", self.minutes.pop(bucket_minute))
+            self._minute = minute
+        if day > self._day:
+            for bucket_day in list(self.days):
+                for window, span in DAY_WINDOWS.items():
+                    if self._day - span < bucket_day <= day - span:
+                        self._queue_expiry(window, self.days[bucket_day])
+                if bucket_day <= day - DAY_WINDOWS["month"]:
+                    del self.days[bucket_day]
+            self._day = day
+
+    # Subtract up to limit queued player entries, returns whether any are left
+    def expire(self, limit=None):
+        done = 0
+        while self._expiring and (limit is None or done < limit):
+            window, server_name, entries = self._expiring[0]
+            for username, packed in entries:
+                self._add(window, None, username, -packed)
+                self._add(window, server_name, username, -packed)
+                done += 1
+                if limit is not None and done >= limit:
+                    break
+            else:
+                self._expiring.popleft()
+        return bool(self._expiring)
+
+    def record(self, server_name, username, kills, deaths, now=None):
+        now = time.time() if now is None else now
+        self.advance(now)
+        minute, day = int(now // 60), date.fromtimestamp(now).toordinal()
+        packed = pack(kills, deaths)
+        # Replayed or late deltas only count towards the windows they still fall in
+        if minute > self._minute - 60:
+            players = self.minutes.setdefault(minute, {}).setdefault(server_name, {})
+            players[username] = players.get(username, 0) + packed
+        if day > self._day - DAY_WINDOWS["month"]:
+            players = self.days.setdefault(day, {}).setdefault(server_name, {})
+            players[username] = players.get(username, 0) + packed
+        for window in WINDOWS:
+            if self._in_window(window, minute, day):
+                self._add(window, None, username, packed)
+                self._add(window, server_name, username, packed)
+
+    def top(self, category, window, server_name=None, now=None):
+        self.advance(time.time() if now is None else now)
+        totals = self.totals[window].get(server_name)
+        if not totals:
+            return []
+        index = self._indexes[(window, server_name, category)]
+        return index.top(lambda: ((username, PlayerRecord(*unpack(total))[category]) for username, total in totals.items()))
+
+    # A copy, so it can be written out while new deltas come in
+    def dump(self):
+        return {
+            'minute': self._minute,
+            'day': self._day,
+            'minutes': {str(minute): {server_name: dict(players) for server_name, players in bucket.items()} for minute, bucket in self.minutes.items()},
+            'days': {str(day): {server_name: dict(players) for server_name, players in bucket.items()} for day, bucket in self.days.items()},
+        }
+
+    def load(self, data):
+        self._minute, self._day = data['minute'], data['day']
+        if self._minute is None:
+            return
+        self.minutes = {int(minute): bucket for minute, bucket in data['minutes'].items() if int(minute) > self._minute - 60}
+        self.days = {int(day): bucket for day, bucket in data['days'].items() if int(day) > self._day - DAY_WINDOWS["month"]}
+        for bucket in self.minutes.values():
+            self._add_bucket("hour", bucket)
+        for day, bucket in self.days.items():
+            for window, span in DAY_WINDOWS.items():
+                if day > self._day - span:
+                    self._add_bucket(window, bucket)
@@ -0,0 +1,38 @@
+import heapq
+
+# Incrementally maintained top-K over values that change one player at a time.
+# A bounded candidate set holds the best players seen; everyone outside it is
+# known to be at or below floor. Queries only look at the candidates, and the
+# set is rebuilt from the full data only when a candidate drops below floor
+# and there are no longer K candidates that provably beat every outsider.
+class TopKIndex:
+    def __init__(self, k=10, capacity=None):
+        self.k = k
+        self.capacity = capacity or k * 4
+        self._candidates = {}
+        self._floor = float('-inf')
+
+    def update(self, key, value):
+        if key in self._candidates or value > self._floor:
+            self._candidates[key] = value
+            if len(self._candidates) > self.capacity:
+                evicted = min(self._candidates, key=self._candidates.get)
+                self._floor = max(self._floor, self._candidates.pop(evicted))
+
+    def remove(self, key):
+        self._candidates.pop(key, None)
+
+    def rebuild(self, items):
+        best = heapq.nlargest(self.capacity + 1, items, key=lambda item: item[1])
+        self._candidates = dict(best[:self.capacity])
+        self._floor = best[self.capacity][1] if len(best) > self.capacity else float('-inf')
+
+    # items_source is called only when a rebuild is needed and must return
+    # every (key, value) pair
+    def top(self, items_source):
+        top = heapq.nlargest(self.k, self._candidates.items(), key=lambda item: item[1])
+        if len(top) < self.k or top[-1][1] < self._floor:
+            if self._floor != float('-inf'):
+                self.rebuild(items_source())
+                top = heapq.nlargest(self.k, self._candidates.items(), key=lambda item: item[1])
+        return top